@@ -7,6 +7,9 @@ from flask_login import LoginManager
 from flask_pagedown import PageDown
 
 from config import CONFIG
+from .cache import SharedCache
+
+import functools
 
 # 创建插件对象
 bootstrap = Bootstrap()
@@ -16,6 +19,7 @@ db = SQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
 pagedown = PageDown()
+cache = SharedCache()   # 多个worker进程共享的缓存
 
 
 def create_app(config_name):
@@ -32,6 +36,40 @@ def create_app(config_name):
     db.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
+    cache.init_app(app)
+    # markdown渲染缓存的容量
+    from .render import render_cache
+    render_cache.resize(app.config["FLASKY_RENDER_CACHE_SIZE"])
+    # 模板片段缓存, 换了应用(测试中重建的数据库)之后id和版本号不再对应原来的内容
+    from .fragments import fragment_cache, cache_fragment
+    fragment_cache.clear()
+    fragment_cache.resize(app.config["FLASKY_FRAGMENT_CACHE_SIZE"])
+    app.add_template_global(cache_fragment)
+    # 用户身份缓存, 换了应用(比如测试中重建的数据库)之后原有的内容不再可信
+    from .models import identity_cache
+    identity_cache.clear()
+    identity_cache.resize(app.config["FLASKY_IDENTITY_CACHE_SIZE"])
+    identity_cache.ttl = app.config["FLASKY_IDENTITY_CACHE_TTL"]
+    # API密码验证结果缓存
+    from .cache import credential_cache
+    credential_cache.configure(app.config["FLASKY_CREDENTIAL_CACHE_SIZE"], app.config["FLASKY_CREDENTIAL_CACHE_TTL"],
+                               shared=cache)
+    # API令牌作废列表, 与身份缓存一样在换了应用之后重新加载
+    from .tokens import revocation_list
+    revocation_list.clear()
+    # API列表缓存的总数
+    from .pagination import count_cache
+    count_cache.clear()
+    # 开始处理请求时启动邮件发送线程, 发送重启前留在发件箱中的邮件
+    from .email import outbox
+    app.before_first_request(functools.partial(outbox.start, app))
+    # 压缩html和json响应
+    if app.config["FLASKY_COMPRESSION"]:
+        from .compression import GzipMiddleware
+        app.wsgi_app = GzipMiddleware(app.wsgi_app, level=app.config["FLASKY_COMPRESSION_LEVEL"],
+                                      min_size=app.config["FLASKY_COMPRESSION_MIN_SIZE"],
+                                      mimetypes=app.config["FLASKY_COMPRESSION_MIMETYPES"])
+        app.extensions["compression"] = app.wsgi_app
     # 把所有请求重定向到安全的HTTP协议
     if app.config["SSL_REDIRECT"]:
         from flask_sslify import SSLify
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api = Blueprint("api", __name__)
 
-from . import authentication, posts, users, comments, errors
+from . import authentication, posts, users, comments, errors, stats, conditional, export
@@ -1,9 +1,15 @@
-from flask import g, jsonify
+from flask import g, jsonify, current_app
 from flask_httpauth import HTTPBasicAuth
+from werkzeug.local import LocalProxy
 
 from . import api
 from .errors import unauthorized, forbidden
-from ..models import User
+from ..cache import credential_cache
+from ..models import User, load_cached_user
+from ..tokens import verify_token
+
+import functools
+import time
 
 auth = HTTPBasicAuth()
 
@@ -17,30 +23,56 @@ def auth_error():
 @auth.login_required
 def before_request():
     # 用户已经注册, 但还没有完成确认的用户将会被拒
-    if not g.current_user.is_anonymous and not g.current_user.confirmed:
+    if not g.current_identity.is_anonymous and not g.current_identity.confirmed:
         return forbidden("Unconfirmed account") 
 
 
+def token_user(user_id):
+    """令牌对应的用户对象, 每个请求中第一次用到时加载一次, 之后直接返回g中保存的对象"""
+    if "token_user" not in g:
+        g.token_user = load_cached_user(user_id)
+    return g.token_user
+
+
 @auth.verify_password
 def verify_password(email_or_token, password):
     # 可以依据邮件地址或是令牌来验证用户
     if email_or_token == "":
         return False
     if password == "":
-        g.current_user = User.verify_auth_token(email_or_token)
+        # 令牌中已经带有确认状态和权限, 鉴权不需要查询数据库, 用到用户对象时才加载
+        identity = verify_token(email_or_token)
+        if identity is None:
+            return False
+        g.current_identity = identity
+        g.current_user = LocalProxy(functools.partial(token_user, identity.id))
         g.token_used = True
-        return g.current_user is not None
+        return True
+    # 最近验证成功过的组合直接使用缓存的结果, 不再查询用户和计算密码hash
+    key = credential_cache.key(current_app.config["SECRET_KEY"], email_or_token, password)
+    user_id = credential_cache.get(key)
+    if user_id is not None:
+        user = load_cached_user(user_id)
+        if user is not None:
+            g.current_user = g.current_identity = user
+            g.token_used = False
+            return True
     user = User.query.filter_by(email=email_or_token).first()
     if not user:
         return False
-    g.current_user = user
+    g.current_user = g.current_identity = user
     g.token_used = False
-    return user.verify_password(password)
+    started = time.perf_counter()
+    verified = user.verify_password(password)
+    credential_cache.record_verification(time.perf_counter() - started)
+    if verified:
+        credential_cache.add(key, user.id, user.token_generation)
+    return verified
 
 
 @api.route("/tokens/", methods=["POST"])
 def get_token():
     # 检查g.token_used, 拒绝使用令牌验证身份. 防止用户绕过令牌过期机制.
-    if g.current_user.is_anonymous or g.token_used:
+    if g.token_used or g.current_user.is_anonymous:
         return unauthorized("Invalid credentials")
     return jsonify({"token": g.current_user.generate_auth_token(expiration=3600), "expiration": 3600})
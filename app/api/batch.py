@@ -0,0 +1,35 @@
+from flask import request, current_app, jsonify
+
+from ..exceptions import ValidationError
+
+
+def requested_batch():
+    """请求体应是JSON数组, 最多FLASKY_API_BATCH_MAX项"""
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        raise ValidationError("request body must be a non-empty JSON array")
+    if len(items) > current_app.config["FLASKY_API_BATCH_MAX"]:
+        raise ValidationError("at most %d items per batch" % current_app.config["FLASKY_API_BATCH_MAX"])
+    return items
+
+
+def build_batch(items, build):
+    """对每一项调用build(item)生成对象, 返回(对象列表, 错误列表)
+    build抛出的ValidationError记为该项的错误, 错误中带有它在数组中的下标"""
+    objects, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError("item must be a JSON object")
+            objects.append(build(item))
+        except ValidationError as e:
+            errors.append({"index": index, "message": e.args[0]})
+    return objects, errors
+
+
+def invalid_items(errors):
+    """有任何一项不合法时整批都不写入, 返回所有错误"""
+    response = jsonify({"error": "bad request", "message": "%d invalid items, nothing was written" % len(errors),
+                        "errors": errors})
+    response.status_code = 400
+    return response
@@ -1,55 +1,86 @@
-from flask import g, jsonify, request, url_for, current_app
+from flask import g, request, url_for, current_app, abort
 
 from . import api
 from .decorators import permission_required
+from .conditional import check_version, object_etag
+from .compound import requested_ids, fetch_by_ids, with_included
+from .batch import requested_batch, build_batch, invalid_items
+from .serializers import COMMENTS, COMMENT_COLUMNS, comment_json, serialize_many, json_response
 from .. import db
+from ..exceptions import ValidationError
 from ..models import Permission, Comment, Post
+from ..pagination import wants_keyset, cursor_args, page_url, paginate_keyset, paginate_offset, count_mode
+
+
+ETAG_COLUMNS = (Comment.version,)
 
 
 @api.route("/comments/")
 def get_comments():
-    # 返回所有的评论
+    # 返回所有的评论, ?ids=1,2,3时只返回指定的评论
+    columns, serialize = COMMENTS.select()   # 只查询和计算?fields=请求的字段
+    ids = requested_ids()
+    if ids is not None:
+        comments = fetch_by_ids(columns, ids)
+        return json_response(with_included({"comments": serialize_many(serialize, comments)}, comments=comments))
+    if wants_keyset():
+        # 游标分页, 不返回总数
+        pagination = paginate_keyset(db.session.query(*columns), (Comment.timestamp, Comment.id),
+                                     current_app.config["FLASKY_COMMENTS_PER_PAGE"], **cursor_args())
+        return json_response(with_included({
+            "comments": serialize_many(serialize, pagination.items),
+            "prev_url": page_url("api.get_comments", before=pagination.prev_cursor) if pagination.has_prev else None,
+            "next_url": page_url("api.get_comments", after=pagination.next_cursor) if pagination.has_next else None,
+        }, comments=pagination.items))
     page = request.args.get("page", 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(page, per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"], error_out=False)
+    pagination = paginate_offset(db.session.query(*columns).order_by(Comment.timestamp.desc()), page,
+                                 current_app.config["FLASKY_COMMENTS_PER_PAGE"], count_mode(), count_key=("comments",))
     comments = pagination.items
     prev_page = None
     if pagination.has_prev:
-        prev_page = url_for("api.get_comments", page=page-1)
+        prev_page = page_url("api.get_comments", page=page-1)
     next_page = None
-    if pagination.hax_next:
-        next_page = url_for("api.get_comments", page=page+1)
-    return jsonify({
-        "comments": [comment.to_json() for comment in comments],
+    if pagination.has_next:
+        next_page = page_url("api.get_comments", page=page+1)
+    return json_response(with_included({
+        "comments": serialize_many(serialize, comments),
         "prev_url": prev_page, "next_url": next_page,
         "count": pagination.total,
-    })
+    }, comments=comments))
 
 
 @api.route("/comments/<int:id>")
 def get_comment(id):
-    # 返回一篇评论
-    comment = Comment.query.get_or_404(id)
-    return jsonify({"comments": comment.to_json()})
+    # 返回一篇评论, 客户端的缓存没有过期时只查询版本号
+    response = check_version(ETAG_COLUMNS, id)
+    if response is not None:
+        return response
+    comment = db.session.query(*COMMENT_COLUMNS).filter(Comment.id == id).first() or abort(404)
+    response = json_response({"comments": comment_json(comment)})
+    response.set_etag(object_etag(comment, ETAG_COLUMNS))
+    return response
 
 
 @api.route("/posts/<int:id>/comments")
 def get_post_comments(id):
     # 返回一篇博客文章的评论
+    columns, serialize = COMMENTS.select()   # 只查询和计算?fields=请求的字段
     post = Post.query.get_or_404(id)
     page = request.args.get("page", 1, type=int)
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(page, per_page=current_app.config("FLASKY_COMMENTS_PER_PAGE"), error_out=False)
+    pagination = paginate_offset(post.comments.with_entities(*columns).order_by(Comment.timestamp.asc()), page,
+                                 current_app.config["FLASKY_COMMENTS_PER_PAGE"], count_mode(), count_key=("post_comments", id))
     comments = pagination.items
     prev_page = None
     if pagination.has_prev:
-        prev_page = url_for("api.get_post_comments", id=id, page=page-1)
+        prev_page = page_url("api.get_post_comments", id=id, page=page-1)
     next_page = None
-    if pagination.hax_next:
-        next_page = url_for("api.get_post_comments", id=id, page=page+1)
-    return jsonify({
-        "comments": [comment.to_sjon() for comment in comments],
+    if pagination.has_next:
+        next_page = page_url("api.get_post_comments", id=id, page=page+1)
+    return json_response(with_included({
+        "comments": serialize_many(serialize, comments),
         "prev_url": prev_page, "next_url": next_page,
         "count": pagination.total,
-    })
+    }, comments=comments))
 
 
 @api.route("/posts/<int:id>/comments", methods=["POST"])
@@ -58,8 +89,40 @@ def new_comment(id):
     # 对一篇文章进行评论
     post = Post.query.get_or_404(id)
     comment = Comment.from_json(request.json)
-    comment.author = g.current_user
+    comment.author_id = g.current_identity.id
     comment.post = post
     db.session.add(comment)
     db.session.commit()
-    return jsonify(comment.to_json()), 201, {'Location': url_for('api.get_comment', id=comment.id)}
+    return json_response(comment_json(comment)), 201, {'Location': url_for('api.get_comment', id=comment.id)}
+
+
+def comment_from_batch_item(item):
+    """批量评论中的每一项需要给出post_id"""
+    post_id = item.get("post_id")
+    if not isinstance(post_id, int) or isinstance(post_id, bool):
+        raise ValidationError("comment does not have a post_id")
+    comment = Comment.from_json(item)
+    comment.post_id = post_id
+    return comment
+
+
+@api.route("/comments/batch", methods=["POST"])
+@permission_required(Permission.COMMENT)
+def new_comments():
+    # 一次新建多条评论(可以属于不同的文章), 在同一个事务中写入, 任何一项不合法时都不写入
+    items = requested_batch()
+    comments, errors = build_batch(items, comment_from_batch_item)
+    post_ids = {comment.post_id for comment in comments}
+    existing = {id for id, in db.session.query(Post.id).filter(Post.id.in_(post_ids))} if post_ids else set()
+    invalid = {error["index"] for error in errors}
+    for index, item in enumerate(items):
+        if index not in invalid and item["post_id"] not in existing:
+            errors.append({"index": index, "message": "post %d does not exist" % item["post_id"]})
+    if errors:
+        return invalid_items(sorted(errors, key=lambda error: error["index"]))
+    for comment in comments:
+        comment.author_id = g.current_identity.id
+    db.session.add_all(comments)
+    db.session.commit()
+    rows = fetch_by_ids(COMMENT_COLUMNS, [comment.id for comment in comments])
+    return json_response({"comments": serialize_many(comment_json, rows)}, status=201)
@@ -0,0 +1,94 @@
+from flask import request, current_app
+
+from .. import db
+from ..exceptions import ValidationError
+from ..models import Post, Comment
+from .serializers import POST_COLUMNS, COMMENT_COLUMNS, USER_COLUMNS, serialize_many, post_json, comment_json, \
+    user_json
+
+from collections import OrderedDict
+import itertools
+
+
+def requested_ids():
+    """解析?ids=1,2,3, 去掉重复的id并保持顺序; 没有ids参数时返回None"""
+    raw = request.args.get("ids")
+    if raw is None:
+        return None
+    try:
+        ids = [int(id) for id in raw.split(",") if id.strip()]
+    except ValueError:
+        raise ValidationError("ids must be comma separated integers")
+    ids = list(OrderedDict.fromkeys(ids))
+    if not ids:
+        raise ValidationError("no ids given")
+    if len(ids) > current_app.config["FLASKY_API_MULTIGET_MAX"]:
+        raise ValidationError("at most %d ids per request" % current_app.config["FLASKY_API_MULTIGET_MAX"])
+    return ids
+
+
+def requested_includes(allowed):
+    """解析?include=author,comments, 包含不支持的名字时抛出ValidationError"""
+    includes = {name.strip() for name in request.args.get("include", "").split(",") if name.strip()}
+    unknown = includes - set(allowed)
+    if unknown:
+        raise ValidationError("cannot include: %s" % ", ".join(sorted(unknown)))
+    return includes
+
+
+def fetch_by_ids(columns, ids):
+    """用一条IN查询取出ids对应行的columns, 按ids的顺序返回, 不存在的id被忽略"""
+    if not ids:
+        return []
+    model = columns[0].class_
+    rows = {row.id: row for row in db.session.query(*columns).filter(model.id.in_(ids))}
+    return [rows[id] for id in ids if id in rows]
+
+
+def supports_window_functions(bind):
+    """row_number() over (...)需要SQLite 3.25及以上, 其他数据库都已支持"""
+    if bind.dialect.name != "sqlite":
+        return True
+    return bind.dialect.dbapi.sqlite_version_info >= (3, 25)
+
+
+def latest_comments(post_ids, limit):
+    """每篇文章最新的limit条评论, 用窗口函数在一条查询中取出
+    SQLite低于3.25时没有窗口函数, 改用带LIMIT的关联子查询, 结果相同"""
+    if not post_ids:
+        return []
+    order = lambda comment: (comment.timestamp.desc(), comment.id.desc())
+    if not supports_window_functions(db.session.get_bind()):
+        newer = db.aliased(Comment)
+        latest = db.select([newer.id]).where(newer.post_id == Comment.post_id).order_by(*order(newer))\
+                   .limit(limit).correlate(Comment)
+        return db.session.query(*COMMENT_COLUMNS).filter(Comment.post_id.in_(post_ids), Comment.id.in_(latest))\
+                         .order_by(Comment.post_id, Comment.timestamp, Comment.id).all()
+    rank = db.func.row_number().over(partition_by=Comment.post_id,
+                                     order_by=order(Comment)).label("rank")
+    ranked = db.session.query(Comment.id, rank).filter(Comment.post_id.in_(post_ids)).subquery()
+    return db.session.query(*COMMENT_COLUMNS).join(ranked, Comment.id == ranked.c.id).filter(ranked.c.rank <= limit)\
+                     .order_by(Comment.post_id, Comment.timestamp, Comment.id).all()
+
+
+def with_included(payload, posts=None, comments=None):
+    """按?include=把关联的资源批量查出, 以{"users": [...], ...}的形式放在payload["included"]中
+    文章可以包含author和comments, 评论可以包含author和post; 客户端用author_url等链接与之对应"""
+    allowed = {"author"} | ({"comments"} if posts is not None else set()) | ({"post"} if comments is not None else set())
+    includes = requested_includes(allowed)
+    if not includes:
+        return payload
+    included = {}
+    posts, comments = list(posts or ()), list(comments or ())
+    if "comments" in includes:
+        extra = latest_comments([post.id for post in posts], current_app.config["FLASKY_API_INCLUDED_COMMENTS"])
+        included["comments"] = serialize_many(comment_json, extra)
+        comments += extra   # 包含的评论的作者一并放入
+    if "post" in includes:
+        post_ids = sorted({comment.post_id for comment in comments} - {post.id for post in posts})
+        included["posts"] = serialize_many(post_json, fetch_by_ids(POST_COLUMNS, post_ids))
+    if "author" in includes:
+        author_ids = sorted({obj.author_id for obj in itertools.chain(posts, comments)} - {None})
+        included["users"] = serialize_many(user_json, fetch_by_ids(USER_COLUMNS, author_ids))
+    payload["included"] = included
+    return payload
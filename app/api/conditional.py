@@ -0,0 +1,45 @@
+from flask import request, make_response, abort
+
+from . import api
+from .. import db
+
+import hashlib
+
+
+def resource_etag(*parts):
+    """由资源的表名, id和版本等生成强ETag"""
+    return hashlib.sha1(repr(parts).encode("U8")).hexdigest()
+
+
+def not_modified(etag):
+    """客户端缓存的ETag仍然有效时返回304响应, 否则返回None
+    If-None-Match按弱比较, 压缩中间件会把ETag改为弱ETag"""
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def check_version(columns, id):
+    """只查询决定资源内容的几列来生成ETag, 不加载对象也不生成json
+    资源不存在时返回404, 客户端缓存仍然有效时返回304响应, 否则返回None"""
+    model = columns[0].class_
+    row = db.session.query(*columns).filter(model.id == id).first()
+    if row is None:
+        abort(404)
+    return not_modified(resource_etag(model.__tablename__, id, *row))
+
+
+def object_etag(obj, columns):
+    """用已加载的对象或行上相同的列生成ETag, 与check_version的结果一致"""
+    return resource_etag(columns[0].class_.__tablename__, obj.id, *(getattr(obj, column.key) for column in columns))
+
+
+@api.after_request
+def conditional_response(response):
+    """GET请求的响应没有ETag时用内容的hash生成, 再按If-None-Match返回304"""
+    if request.method == "GET" and response.status_code == 200 and not response.is_streamed:
+        response.add_etag()
+        return not_modified(response.get_etag()[0]) or response
+    return response
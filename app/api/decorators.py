@@ -9,7 +9,7 @@ def permission_required(permission):
     def decorator(f):
         @functools.wraps(f)
         def decorated_function(*args, **kwargs):
-            if not g.current_user.can(permission):
+            if not g.current_identity.can(permission):   # 令牌验证时不需要加载用户和角色
                 return forbidden("Insufficient permissions")
             return f(*args, **kwargs)
         return decorated_function
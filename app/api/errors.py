@@ -24,4 +24,4 @@ def forbidden(message):
 
 @api.errorhandler(ValidationError)
 def validateion_error(e):
-    return bad_reequest(e.argv[0])
+    return bad_reequest(e.args[0])
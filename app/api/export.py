@@ -0,0 +1,51 @@
+from flask import Response, request, stream_with_context
+
+from . import api
+from .decorators import permission_required
+from .serializers import POSTS, COMMENTS, url_templates, dumps
+from .. import db
+from ..exceptions import ValidationError
+from ..models import Permission, Post, Comment
+
+import datetime
+
+
+EXPORTS = {"posts": (Post, POSTS), "comments": (Comment, COMMENTS)}
+TIMESTAMP_FORMATS = ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+
+
+def parse_timestamp(value, name):
+    """解析since/until参数, 接受ISO 8601格式的UTC时间或日期"""
+    if not value:
+        return None
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.rstrip("Z"), fmt)
+        except ValueError:
+            continue
+    raise ValidationError("%s must be an ISO 8601 timestamp" % name)
+
+
+def export_lines(model, serialize, columns, since=None, until=None, batch_size=1000):
+    """按(timestamp, id)顺序逐行生成NDJSON, 游标每次只取batch_size行, 内存占用与表的大小无关
+    since包含在内, until不包含, 上次导出的until可以直接作为下次的since"""
+    query = db.session.query(*columns).execution_options(stream_results=True)
+    if since is not None:
+        query = query.filter(model.timestamp >= since)
+    if until is not None:
+        query = query.filter(model.timestamp < until)
+    urls = url_templates()
+    for row in query.order_by(model.timestamp, model.id).yield_per(batch_size):
+        yield dumps(serialize(row, urls)) + b"\n"
+
+
+@api.route("/export/<any(posts, comments):table>")
+@permission_required(Permission.ADMIN)
+def export(table):
+    # 以NDJSON流的形式导出全部文章或评论, 支持?since=&until=增量导出和?fields=
+    model, resource = EXPORTS[table]
+    columns, serialize = resource.select()
+    since = parse_timestamp(request.args.get("since"), "since")
+    until = parse_timestamp(request.args.get("until"), "until")
+    lines = export_lines(model, serialize, columns, since, until)
+    return Response(stream_with_context(lines), mimetype="application/x-ndjson")
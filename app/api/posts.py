@@ -1,36 +1,64 @@
-from flask import g, jsonify, request, url_for, current_app
+from flask import g, request, url_for, current_app, abort
 
 from . import api
 from .errors import forbidden
 from .decorators import permission_required
+from .conditional import check_version, object_etag
+from .compound import requested_ids, fetch_by_ids, with_included
+from .batch import requested_batch, build_batch, invalid_items
+from .serializers import POSTS, POST_COLUMNS, post_json, serialize_many, json_response
 from .. import db
 from ..models import Permission, Post
+from ..pagination import wants_keyset, cursor_args, page_url, paginate_keyset, paginate_offset, count_mode
+
+
+ETAG_COLUMNS = (Post.version,)   # 所有修改都会增加版本号
 
 
 @api.route("/posts/", methods=["GET"])
 def get_posts():
-    # 使用GET获取所有的post
+    # 使用GET获取所有的post, ?ids=1,2,3时只返回指定的post
+    columns, serialize = POSTS.select()   # 只查询和计算?fields=请求的字段
+    ids = requested_ids()
+    if ids is not None:
+        posts = fetch_by_ids(columns, ids)
+        return json_response(with_included({"posts": serialize_many(serialize, posts)}, posts=posts))
+    if wants_keyset():
+        # 游标分页, 不返回总数
+        pagination = paginate_keyset(db.session.query(*columns), (Post.timestamp, Post.id),
+                                     current_app.config["FLASKY_POST_PER_PAGE"], **cursor_args())
+        return json_response(with_included({
+            "posts": serialize_many(serialize, pagination.items),
+            "prev_url": page_url("api.get_posts", before=pagination.prev_cursor) if pagination.has_prev else None,
+            "next_url": page_url("api.get_posts", after=pagination.next_cursor) if pagination.has_next else None,
+        }, posts=pagination.items))
     page = request.args.get("page", 1, type=int)
-    pagination = Post.query.paginate(page, per_page=current_app.config["FLASKY_POSTS_PER_PAGE"], error_out=False)
+    pagination = paginate_offset(db.session.query(*columns), page, current_app.config["FLASKY_POST_PER_PAGE"],
+                                 count_mode(), count_key=("posts",))
     posts = pagination.items
     prev_page = None
     if pagination.has_prev:
-        prev_page = url_for("api.get_posts", page=page-1)
+        prev_page = page_url("api.get_posts", page=page-1)
     next_page = None
     if pagination.has_next:
-        next_page = url_for("api.get_posts", page=page+1)
-    return jsonify({
-        "posts": [post.to_json() for post in posts],
+        next_page = page_url("api.get_posts", page=page+1)
+    return json_response(with_included({
+        "posts": serialize_many(serialize, posts),
         "prev_url": prev_page, "next_url": next_page,
         "count": pagination.total,
-    })
+    }, posts=posts))
 
 
 @api.route("/posts/<int:id>", methods=["GET"])
 def get_post(id):
-    # 使用GET获取指定id的post
-    post = Post.query.get_or_404(id)
-    return jsonify({"posts": post.to_json()})
+    # 使用GET获取指定id的post, 客户端的缓存没有过期时只查询版本号
+    response = check_version(ETAG_COLUMNS, id)
+    if response is not None:
+        return response
+    post = db.session.query(*POST_COLUMNS).filter(Post.id == id).first() or abort(404)
+    response = json_response({"posts": post_json(post)})
+    response.set_etag(object_etag(post, ETAG_COLUMNS))
+    return response
 
 
 @api.route("/posts/", methods=["POST"])
@@ -38,10 +66,25 @@ def get_post(id):
 def new_post():
     # 使用POST新建post
     post = Post.from_json(request.json)
-    post.author = g.current_user
+    post.author_id = g.current_identity.id
     db.session.add(post)
-    ad.session.commit()
-    return jsonify(post.to_json()), 201, {"Location": url_for("api.get_post", id=post.id)}
+    db.session.commit()
+    return json_response(post_json(post)), 201, {"Location": url_for("api.get_post", id=post.id)}
+
+
+@api.route("/posts/batch", methods=["POST"])
+@permission_required(Permission.WRITE)
+def new_posts():
+    # 一次新建多篇post, 在同一个事务中写入, 任何一项不合法时都不写入
+    posts, errors = build_batch(requested_batch(), Post.from_json)
+    if errors:
+        return invalid_items(errors)
+    for post in posts:
+        post.author_id = g.current_identity.id
+    db.session.add_all(posts)
+    db.session.commit()
+    rows = fetch_by_ids(POST_COLUMNS, [post.id for post in posts])
+    return json_response({"posts": serialize_many(post_json, rows)}, status=201)
 
 
 @api.route("/posts/<int:id>", methods=["PUT"])
@@ -49,9 +92,9 @@ def new_post():
 def edit_post(id):
     # 使用PUT更改post
     post = Post.query.get_or_404(id)
-    if g.current_user != post.author and not g.current_user.can(Permission.ADMIN):
+    if g.current_identity.id != post.author_id and not g.current_identity.can(Permission.ADMIN):
         return forbidden("Insuficient permissions")
     post.body = request.json.get("body", post.body)   # 让原post的body如果有新的提交变为新的, 否则还是原来的.
     db.session.add(post)
     db.session.commit()
-    return jsonify(post.to_json()), 200
+    return json_response(post_json(post))
@@ -0,0 +1,155 @@
+from flask import current_app, request, url_for
+from werkzeug.http import http_date
+
+from ..exceptions import ValidationError
+from ..models import User, Post, Comment
+
+from collections import OrderedDict
+import datetime
+
+# 有更快的json库时优先使用, 都没有时使用标准库
+try:
+    import orjson
+    json_library = "orjson"
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    try:
+        import ujson
+        json_library = "ujson"
+
+        def dumps(obj):
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("U8")
+    except ImportError:
+        import json
+        json_library = "json"
+
+        def dumps(obj):
+            return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("U8")
+
+
+_URL_ENDPOINTS = ("api.get_post", "api.get_post_comments", "api.get_user", "api.get_user_posts",
+                  "api.get_user_followed_posts", "api.get_comment")
+_ID_SENTINEL = 918273645   # 生成模板时代替id, 再替换为占位符
+
+
+def url_templates():
+    """每个端点的url模板, 如"/api/ver1/posts/{}", 每个应用(和挂载路径)只调用一次url_for"""
+    cache = current_app.extensions.setdefault("api_url_templates", {})
+    script_root = request.script_root
+    templates = cache.get(script_root)
+    if templates is None:
+        templates = {endpoint: url_for(endpoint, id=_ID_SENTINEL).replace(str(_ID_SENTINEL), "{}")
+                     for endpoint in _URL_ENDPOINTS}
+        cache[script_root] = templates
+    return templates
+
+
+def format_datetime(value):
+    """与flask的json编码器对datetime的输出相同(HTTP日期格式)"""
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return http_date(value.utctimetuple())
+    return value
+
+
+class Resource:
+    """一种API资源的输出字段, 每个字段给出需要查询的列和计算函数
+    ?fields=只查询和计算请求的字段, key_columns总会查询(分页, include和链接需要用到)"""
+    def __init__(self, key_columns, fields, default):
+        self.key_columns = key_columns
+        self.fields = fields   # 字段名 -> (需要的列, 计算函数(row, urls))
+        self.default = default
+        self._serializers = {}
+
+    def requested_fields(self):
+        """解析?fields=id,timestamp, 没有fields参数时返回默认的字段"""
+        raw = request.args.get("fields")
+        if raw is None:
+            return self.default
+        names = tuple(OrderedDict.fromkeys(name.strip() for name in raw.split(",") if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if not names or unknown:
+            raise ValidationError("unknown fields: %s, available: %s" % (", ".join(unknown) or "(none)",
+                                                                          ", ".join(self.fields)))
+        return names
+
+    def select(self):
+        """按请求的?fields=返回需要查询的列和序列化函数"""
+        names = self.requested_fields()
+        return self.columns(names), self.serializer(names)
+
+    def columns(self, names):
+        """输出names需要查询的列"""
+        columns = OrderedDict((column.key, column) for column in self.key_columns)
+        for name in names:
+            for column in self.fields[name][0]:
+                columns.setdefault(column.key, column)
+        return tuple(columns.values())
+
+    def serializer(self, names):
+        """只计算names中字段的序列化函数"""
+        serializer = self._serializers.get(names)
+        if serializer is None:
+            getters = [(name, self.fields[name][1]) for name in names]
+
+            def serializer(row, urls=None):
+                urls = urls or url_templates()
+                return {name: getter(row, urls) for name, getter in getters}
+            self._serializers[names] = serializer
+        return serializer
+
+
+POSTS = Resource((Post.id, Post.timestamp, Post.author_id), OrderedDict([
+    ("id", ((), lambda row, urls: row.id)),
+    ("url", ((), lambda row, urls: urls["api.get_post"].format(row.id))),
+    ("body", ((Post.body,), lambda row, urls: row.body)),
+    ("body_html", ((Post.body_html,), lambda row, urls: row.body_html)),
+    ("timestamp", ((), lambda row, urls: format_datetime(row.timestamp))),
+    ("author_url", ((), lambda row, urls: urls["api.get_user"].format(row.author_id))),
+    ("comments_url", ((), lambda row, urls: urls["api.get_post_comments"].format(row.id))),
+    ("comment_count", ((Post.comment_count,), lambda row, urls: row.comment_count)),
+]), default=("url", "body", "body_html", "timestamp", "author_url", "comments_url", "comment_count"))
+
+COMMENTS = Resource((Comment.id, Comment.timestamp, Comment.author_id, Comment.post_id), OrderedDict([
+    ("id", ((), lambda row, urls: row.id)),
+    ("url", ((), lambda row, urls: urls["api.get_comment"].format(row.id))),
+    ("body", ((Comment.body,), lambda row, urls: row.body)),
+    ("body_html", ((Comment.body_html,), lambda row, urls: row.body_html)),
+    ("timestamp", ((), lambda row, urls: format_datetime(row.timestamp))),
+    ("author_url", ((), lambda row, urls: urls["api.get_user"].format(row.author_id))),
+    ("post_url", ((), lambda row, urls: urls["api.get_post"].format(row.post_id))),
+]), default=("url", "body", "body_html", "timestamp", "author_url", "post_url"))
+
+USERS = Resource((User.id,), OrderedDict([
+    ("id", ((), lambda row, urls: row.id)),
+    ("url", ((), lambda row, urls: urls["api.get_user"].format(row.id))),
+    ("username", ((User.username,), lambda row, urls: row.username)),
+    ("member_since", ((User.member_since,), lambda row, urls: format_datetime(row.member_since))),
+    ("last_seen", ((User.last_seen,), lambda row, urls: format_datetime(row.last_seen))),
+    ("posts_url", ((), lambda row, urls: urls["api.get_user_posts"].format(row.id))),
+    ("followd_posts_url", ((), lambda row, urls: urls["api.get_user_followed_posts"].format(row.id))),
+    ("post_count", ((User.post_count,), lambda row, urls: row.post_count)),
+]), default=("url", "username", "member_since", "last_seen", "posts_url", "followd_posts_url", "post_count"))
+
+# 默认输出需要的列, 单个资源还需要版本号来生成ETag
+POST_COLUMNS = POSTS.columns(POSTS.default) + (Post.version,)
+COMMENT_COLUMNS = COMMENTS.columns(COMMENTS.default) + (Comment.version,)
+USER_COLUMNS = USERS.columns(USERS.default)
+
+post_json = POSTS.serializer(POSTS.default)
+comment_json = COMMENTS.serializer(COMMENTS.default)
+user_json = USERS.serializer(USERS.default)
+
+
+def serialize_many(serializer, rows):
+    """批量序列化, url模板只取一次"""
+    urls = url_templates()
+    return [serializer(row, urls) for row in rows]
+
+
+def json_response(payload, status=200):
+    """代替jsonify, 使用更快的json库, datetime应已由format_datetime格式化"""
+    return current_app.response_class(dumps(payload) + b"\n", status=status, mimetype="application/json")
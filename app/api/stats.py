@@ -0,0 +1,24 @@
+from flask import jsonify, current_app
+
+from . import api
+from .decorators import permission_required
+from ..cache import credential_cache
+from ..email import outbox
+from ..fragments import fragment_cache
+from ..models import Permission, identity_cache
+from ..render import render_cache, render_pool
+
+
+@api.route("/stats/")
+@permission_required(Permission.ADMIN)
+def get_stats():
+    # 返回当前worker进程中各个缓存的命中情况
+    return jsonify({
+        "credential_cache": credential_cache.stats(),
+        "identity_cache": identity_cache.stats(),
+        "render_cache": render_cache.stats(),
+        "fragment_cache": fragment_cache.stats(),
+        "render_pending": render_pool.pending,
+        "mail_outbox": outbox.depth(),
+        "compression": current_app.extensions["compression"].stats() if "compression" in current_app.extensions else None,
+    })
@@ -1,51 +1,98 @@
-from flask import g, jsonify, request, url_for, current_app
+from flask import g, request, url_for, current_app, abort
 
 from . import api
+from .conditional import check_version, object_etag
+from .compound import requested_ids, fetch_by_ids, with_included
+from .serializers import POSTS, USERS, USER_COLUMNS, user_json, serialize_many, json_response
 from .. import db
-from ..models import User, Post
+from ..exceptions import ValidationError
+from ..models import User, Post, Timeline
+from ..pagination import wants_keyset, cursor_args, page_url, paginate_keyset, paginate_offset, count_mode
+
+
+# 用户没有版本号, 用to_json中会变化的列生成ETag
+ETAG_COLUMNS = (User.username, User.member_since, User.last_seen, User.post_count)
+
+
+@api.route("/users/")
+def get_users():
+    # 返回?ids=1,2,3指定的多个用户
+    columns, serialize = USERS.select()   # 只查询和计算?fields=请求的字段
+    ids = requested_ids()
+    if ids is None:
+        raise ValidationError("ids is required")
+    return json_response({"users": serialize_many(serialize, fetch_by_ids(columns, ids))})
 
 
 @api.route("/users/<int:id>")
 def get_user(id):
-    # 返回一个用户
-    user = User.query.get_or_404(id)
-    return jsonify({"users": user.to_json()})
+    # 返回一个用户, 客户端的缓存没有过期时只查询决定输出内容的几列
+    response = check_version(ETAG_COLUMNS, id)
+    if response is not None:
+        return response
+    user = db.session.query(*USER_COLUMNS).filter(User.id == id).first() or abort(404)
+    response = json_response({"users": user_json(user)})
+    response.set_etag(object_etag(user, ETAG_COLUMNS))
+    return response
 
 
 @api.route("/users/<int:id>/posts")
 def get_user_posts(id):
     # 返回一个用户发布的所有博客文章
+    columns, serialize = POSTS.select()   # 只查询和计算?fields=请求的字段
     user = User.query.get_or_404(id)
+    if wants_keyset():
+        # 游标分页, 不返回总数
+        pagination = paginate_keyset(user.posts.with_entities(*columns), (Post.timestamp, Post.id),
+                                     current_app.config["FLASKY_POST_PER_PAGE"], **cursor_args())
+        return json_response(with_included({
+            "posts": serialize_many(serialize, pagination.items),
+            "prev_url": page_url("api.get_user_posts", id=id, before=pagination.prev_cursor) if pagination.has_prev else None,
+            "next_url": page_url("api.get_user_posts", id=id, after=pagination.next_cursor) if pagination.has_next else None,
+        }, posts=pagination.items))
     page = request.args.get("page", 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(page, per_page=current_app.config["FLASKY_POST_PER_PAGE"], error_out=False)
+    pagination = paginate_offset(user.posts.with_entities(*columns).order_by(Post.timestamp.desc()), page,
+                                 current_app.config["FLASKY_POST_PER_PAGE"], count_mode(), count_key=("user_posts", id))
     posts = pagination.items
     prev_page = None
     if pagination.has_prev:
-        prev_page = url_for("api.get_user_posts", id=id, page=page-1)
+        prev_page = page_url("api.get_user_posts", id=id, page=page-1)
     next_page = None
     if pagination.has_next:
-        next_page = url_for("api.get_user_posts", id=id, page=page+1)
-    return jsonify({
-        "posts": [post.to_json() for post in posts],
+        next_page = page_url("api.get_user_posts", id=id, page=page+1)
+    return json_response(with_included({
+        "posts": serialize_many(serialize, posts),
         "prev_url": prev_page, "next_url": next_page,
         "count": pagination.total,
-    })
+    }, posts=posts))
 
 
 @api.route("/users/<int:id>/timeline")
 def get_user_followed_posts(id):
     # 返回一个用户所关注用户发布的所有文章
+    columns, serialize = POSTS.select()   # 只查询和计算?fields=请求的字段
     user = User.query.get_or_404(id)
+    if wants_keyset():
+        # 游标分页, 按时间线表的(timestamp, post_id)排序, 不返回总数
+        pagination = paginate_keyset(user.followed_posts.with_entities(*columns), (Timeline.timestamp, Timeline.post_id),
+                                     current_app.config["FLASKY_POST_PER_PAGE"], **cursor_args())
+        return json_response(with_included({
+            "posts": serialize_many(serialize, pagination.items),
+            "prev_url": page_url("api.get_user_followed_posts", id=id, before=pagination.prev_cursor) if pagination.has_prev else None,
+            "next_url": page_url("api.get_user_followed_posts", id=id, after=pagination.next_cursor) if pagination.has_next else None,
+        }, posts=pagination.items))
     page = request.args.get("page", 1, type=int)
-    pagination = user.followed_posts.paginate(page, per_page=current_app.config["FLASKY_POST_PER_PAGE"], error_out=False)
+    pagination = paginate_offset(user.followed_posts.with_entities(*columns), page, current_app.config["FLASKY_POST_PER_PAGE"],
+                                 count_mode(), count_key=("timeline", id))
     posts = pagination.items
     prev_page = None
     if pagination.has_prev:
-        prev_page = url_for("api.get_user_followed_posts", id=id, page=page-1)
+        prev_page = page_url("api.get_user_followed_posts", id=id, page=page-1)
+    next_page = None
     if pagination.has_next:
-        next_page = url_for("api.get_user_followed_posts", id=id, page=page+1)
-    return jsonify({
-        "posts": [post.to_json() for post in posts],
+        next_page = page_url("api.get_user_followed_posts", id=id, page=page+1)
+    return json_response(with_included({
+        "posts": serialize_many(serialize, posts),
         "prev_url": prev_page, "next_url": next_page,
         "count": pagination.total,
-    })
+    }, posts=posts))
@@ -1,15 +1,13 @@
 from flask import current_app, render_template, redirect, abort, request, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.contrib.cache import SimpleCache
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 
-from .. import db
+from .. import db, cache
 from . import auth
 from .forms import LoginForm, RegistrationForm, ChangePasswordForm, EmailForm, ResetPasswordForm, ChangeEmailForm
 from ..models import User
 from ..email import send_email
 
-CACHE = SimpleCache()
 
 @auth.route("/login", methods=["GET", "POST"])
 def login():
@@ -68,13 +66,15 @@ def confirm_account(token):
 @auth.before_app_request
 def before_request():
     """对用户的每次请求都进行提前的检查
+    对静态文件的请求不做检查
     用户已登录, 将更新登录时间), 执行之后检查
-    用户未确认邮箱, 并且请求的URL不在auth蓝本中, 也不是对静态文件的请求, 将会重定向到要求确认邮箱的界面
+    用户未确认邮箱, 并且请求的URL不在auth蓝本中, 将会重定向到要求确认邮箱的界面
     """
+    if request.endpoint == "static":
+        return
     if current_user.is_authenticated:
         current_user.ping()
-        if not current_user.confirmed and \
-           request.blueprint != "auth" and request.endpoint != "static":
+        if not current_user.confirmed and request.blueprint != "auth":
             return redirect(url_for("auth.unconfirmed"))
 
 
@@ -183,7 +183,8 @@ def change_email01():
     #     return redirect(url_for("auth.confirm"))
     form = EmailForm()
     if form.validate_on_submit():
-        CACHE.set(key="new_email_" + current_user.id, value=form.new_email.data, timeout=3600)
+        # 确认链接可能由其他worker处理, 新邮箱保存在共享缓存中
+        cache.set("new_email_%s" % current_user.id, form.new_email.data, timeout=3600)
         token = generate_reset_token({"user_id": current_user.id}, expiration=3600)
         send_email(current_user.email, "重置密码", "auth/email/email_change", token=token)
     return render_template("auth/email_change.html", form=form)
@@ -197,7 +198,7 @@ def change_email02(token):
         flash("Change email address failed.")
         logout_user()
         return redirect(url_for("main.index"))
-    new_email = CACHE.get("new_email_" + user_id)
+    new_email = cache.get("new_email_%s" % user_id)
     if not new_email:
         flash("Change email address expired.")
         logout_user()
@@ -0,0 +1,287 @@
+from werkzeug.contrib.cache import BaseCache, NullCache, SimpleCache, FileSystemCache
+
+from collections import OrderedDict
+import binascii
+import hashlib
+import hmac
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class LRUCache:
+    """进程内线程安全的LRU缓存, 超过容量时淘汰最久未使用的项, 可选过期时间, 统计命中与未命中次数"""
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+        }
+
+
+class CredentialCache:
+    """缓存短时间内验证成功的邮箱和密码组合, 免去每次API请求都计算PBKDF2
+    键是用SECRET_KEY对(email, password)计算的HMAC, 内存中不保存明文密码
+    每项同时记录用户的令牌代数和共享缓存中该用户的凭据标记, 命中时与所有worker都能看到的值比较:
+    修改密码会增加令牌代数(作废列表从数据库刷新), 修改密码或邮箱都会更换共享缓存中的标记"""
+    def __init__(self, maxsize=1024, ttl=60):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._user_keys = {}   # user_id -> 该用户的缓存键, 修改密码时使用
+        self._lock = threading.Lock()
+        self._shared = NullCache()
+        self.verifications = 0
+        self.verify_seconds = 0.0
+
+    def configure(self, maxsize, ttl, shared=None):
+        self._shared = shared if shared is not None else NullCache()
+        self.clear()
+        self.verifications = 0
+        self.verify_seconds = 0.0
+        self._cache.hits = self._cache.misses = 0
+        self._cache.resize(maxsize)
+        self._cache.ttl = ttl
+
+    @staticmethod
+    def key(secret_key, email, password):
+        message = "\0".join(["credentials", email, password]).encode("U8")
+        return hmac.new(secret_key.encode("U8"), message, hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def stamp_key(user_id):
+        return "credential_stamp:%s" % user_id
+
+    def get(self, key):
+        """返回验证成功过的用户id, 没有或已经失效时返回None"""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        user_id, generation, stamp = entry
+        from .tokens import revocation_list
+        if revocation_list.is_revoked(user_id, generation) or self._shared.get(self.stamp_key(user_id)) != stamp:
+            self._cache.delete(key)
+            return None
+        return user_id
+
+    def add(self, key, user_id, generation):
+        stamp = self._shared.get(self.stamp_key(user_id))
+        self._cache.set(key, (user_id, generation or 0, stamp))
+        with self._lock:
+            self._user_keys.setdefault(user_id, set()).add(key)
+
+    def record_verification(self, seconds):
+        """记录一次完整的密码验证耗时, 用来估算缓存节省的CPU时间"""
+        with self._lock:
+            self.verifications += 1
+            self.verify_seconds += seconds
+
+    def invalidate_user(self, user_id):
+        """本进程立即删除该用户的缓存项, 并更换共享缓存中的标记让其他worker中的缓存项失效
+        标记只需保存一个缓存有效期: 此后换标记之前加入的缓存项都已过期"""
+        with self._lock:
+            keys = self._user_keys.pop(user_id, ())
+        for key in keys:
+            self._cache.delete(key)
+        self._shared.set(self.stamp_key(user_id), binascii.hexlify(os.urandom(8)).decode(), self._cache.ttl or 0)
+
+    def clear(self):
+        self._cache.clear()
+        with self._lock:
+            self._user_keys.clear()
+
+    def stats(self):
+        stats = self._cache.stats()
+        average = self.verify_seconds / self.verifications if self.verifications else 0.0
+        stats.update({
+            "verifications": self.verifications,
+            "average_verify_seconds": average,
+            "saved_cpu_seconds": self._cache.hits * average,
+        })
+        return stats
+
+
+credential_cache = CredentialCache()
+
+
+class SqliteCache(BaseCache):
+    """保存在本机SQLite文件中的缓存, 同一台机器上的多个worker进程共享
+    超过threshold条时先删除过期的项, 仍然超过时删除最早到期的项, 刚写入的项不会被删除"""
+    def __init__(self, path, threshold=500, default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        self.path = path
+        self._threshold = threshold
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_expires ON cache (expires)")
+
+    def _connection(self):
+        # sqlite3的连接不能跨线程和fork使用, 每个线程各自打开一个
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _expires(self, timeout):
+        """0表示永不过期, 与werkzeug的缓存相同"""
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else 0
+
+    def _prune(self, conn, key):
+        if conn.execute("SELECT count(*) FROM cache").fetchone()[0] <= self._threshold:
+            return
+        conn.execute("DELETE FROM cache WHERE expires != 0 AND expires <= ?", (time.time(),))
+        conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache WHERE key != ? ORDER BY expires = 0, expires "
+                     "LIMIT max(0, (SELECT count(*) FROM cache) - ?))", (key, self._threshold))
+
+    def get(self, key):
+        row = self._connection().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] != 0 and row[1] <= time.time()):
+            return None
+        try:
+            return pickle.loads(row[0])
+        except pickle.PickleError:
+            return None
+
+    def set(self, key, value, timeout=None):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                         (key, value, self._expires(timeout)))
+            self._prune(conn, key)
+        return True
+
+    def add(self, key, value, timeout=None):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._connection() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires != 0 AND expires <= ?", (key, time.time()))
+            added = conn.execute("INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                                 (key, value, self._expires(timeout))).rowcount == 1
+            if added:
+                self._prune(conn, key)
+        return added
+
+    def delete(self, key):
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount == 1
+
+    def has(self, key):
+        row = self._connection().execute("SELECT expires FROM cache WHERE key = ?", (key,)).fetchone()
+        return row is not None and (row[0] == 0 or row[0] > time.time())
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM cache")
+        return True
+
+
+class SharedCache:
+    """应用使用的键值缓存, 后端由FLASKY_CACHE_TYPE选择:
+    null: 不缓存; simple: 进程内存, 只适合单进程; filesystem: 缓存目录; sqlite: 本机的SQLite文件
+    filesystem和sqlite可以在同一台机器上的多个worker进程之间共享
+    缓存文件默认放在应用的instance目录中: 缓存的值用pickle保存, 不能放在其他用户可写的位置
+    所有键都加上FLASKY_CACHE_KEY_PREFIX, 没有配置时由数据库地址生成, 不同的部署即使共用缓存也不会冲突"""
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.prefix = ""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        cache_type = config["FLASKY_CACHE_TYPE"]
+        options = dict(threshold=config["FLASKY_CACHE_THRESHOLD"], default_timeout=config["FLASKY_CACHE_DEFAULT_TIMEOUT"])
+        if cache_type == "null":
+            self.backend = NullCache(default_timeout=options["default_timeout"])
+        elif cache_type == "simple":
+            self.backend = SimpleCache(**options)
+        elif cache_type == "filesystem":
+            self.backend = FileSystemCache(config["FLASKY_CACHE_DIR"] or self._instance_file(app, "cache"), **options)
+        elif cache_type == "sqlite":
+            self.backend = SqliteCache(config["FLASKY_CACHE_PATH"] or self._instance_file(app, "cache.sqlite"), **options)
+        else:
+            raise ValueError("unknown FLASKY_CACHE_TYPE: %r" % cache_type)
+        self.prefix = config["FLASKY_CACHE_KEY_PREFIX"]
+        if self.prefix is None:
+            database = str(config.get("SQLALCHEMY_DATABASE_URI")).encode("U8")
+            self.prefix = hashlib.sha1(database).hexdigest()[:8] + ":"
+        app.extensions["cache"] = self.backend
+
+    @staticmethod
+    def _instance_file(app, name):
+        """instance目录只有运行应用的用户可以访问"""
+        os.makedirs(app.instance_path, mode=0o700, exist_ok=True)
+        return os.path.join(app.instance_path, name)
+
+    def get(self, key):
+        return self.backend.get(self.prefix + key)
+
+    def set(self, key, value, timeout=None):
+        return self.backend.set(self.prefix + key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        return self.backend.add(self.prefix + key, value, timeout)
+
+    def delete(self, key):
+        return self.backend.delete(self.prefix + key)
+
+    def has(self, key):
+        return self.backend.has(self.prefix + key)
+
+    def clear(self):
+        return self.backend.clear()
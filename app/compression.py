@@ -0,0 +1,84 @@
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, quote_etag, unquote_etag
+
+import gzip
+import threading
+import time
+
+
+class GzipMiddleware:
+    """对html和json等响应做gzip压缩的WSGI中间件
+    只压缩带有Content-Length且不小于min_size的响应; 没有长度的流式响应和已经编码过的响应原样返回
+    压缩后的ETag改为弱ETag, 表示内容等价但字节不同"""
+    def __init__(self, app, level=6, min_size=500, mimetypes=("text/html", "application/json")):
+        self.app = app
+        self.level = level
+        self.min_size = min_size
+        self.mimetypes = set(mimetypes)
+        self._lock = threading.Lock()
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def _accepts_gzip(self, environ):
+        return parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING", "")).quality("gzip") > 0
+
+    def _should_compress(self, status, headers):
+        if not status.startswith("200"):
+            return False
+        if "Content-Encoding" in headers or "Content-Range" in headers:
+            return False
+        if headers.get("Content-Type", "").split(";")[0].strip() not in self.mimetypes:
+            return False
+        length = headers.get("Content-Length", type=int)
+        return length is not None and length >= self.min_size
+
+    def __call__(self, environ, start_response):
+        if environ.get("REQUEST_METHOD") == "HEAD" or not self._accepts_gzip(environ):
+            return self.app(environ, start_response)
+        state = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            state["compress"] = self._should_compress(status, Headers(headers))
+            if not state["compress"]:
+                return start_response(status, headers, exc_info)
+            state["response"] = (status, headers, exc_info)
+            return state.setdefault("body", []).append   # 兼容write()
+
+        app_iter = self.app(environ, capture_start_response)
+        if not state.get("compress"):
+            return app_iter
+        try:
+            body = b"".join(state.get("body", []) + list(app_iter))
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+        started = time.perf_counter()
+        compressed = gzip.compress(body, self.level)
+        elapsed = time.perf_counter() - started
+        status, headers, exc_info = state["response"]
+        headers = Headers(headers)
+        headers["Content-Encoding"] = "gzip"
+        headers["Content-Length"] = str(len(compressed))
+        vary = headers.get("Vary")
+        headers["Vary"] = vary + ", Accept-Encoding" if vary else "Accept-Encoding"
+        if "ETag" in headers:
+            headers["ETag"] = quote_etag(unquote_etag(headers["ETag"])[0], weak=True)
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(compressed)
+            self.seconds += elapsed
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return [compressed]
+
+    def stats(self):
+        return {
+            "level": self.level,
+            "responses": self.responses,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "seconds": self.seconds,
+        }
@@ -1,20 +1,165 @@
-from threading import Thread
 from flask import current_app, render_template
 from flask_mail import Message
-from . import mail
+from . import db, mail
+from .models import OutboxMessage
 
-
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+from threading import Event, Lock, Thread
+import datetime
+import os
+import smtplib
+import time
 
 
 def send_email(to, subject, template, **kwargs):
+    """把邮件写入发件箱并唤醒发送线程, 请求中不再等待SMTP"""
     app = current_app._get_current_object()
-    msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    table = OutboxMessage.__table__
+    db.engine.execute(table.insert().values(
+        sender=app.config['FLASKY_MAIL_SENDER'], recipient=to,
+        subject=app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
+        body=render_template(template + '.txt', **kwargs),
+        html=render_template(template + '.html', **kwargs),
+        timestamp=datetime.datetime.utcnow(), attempts=0,
+        next_attempt_at=datetime.datetime.utcnow(), failed=False,
+    ))
+    outbox.notify(app)
+
+
+class Outbox:
+    """数量固定的发送线程, 从mail_outbox表中取出到期的邮件发送
+    每个线程复用一个SMTP连接, 空闲一段时间后关闭; 失败的邮件按指数退避重试"""
+    def __init__(self):
+        self._wakeup = Event()
+        self._threads = []
+        self._pid = None
+        self._lock = Lock()
+
+    def start(self, app):
+        """启动发送线程, 应用开始处理请求时调用, 重启前留在发件箱中和等待重试的邮件不必等到有新邮件才发送
+        FLASKY_MAIL_WORKERS为0时不启动, 邮件只写入发件箱, 由drain()发送; 返回是否有发送线程"""
+        workers = app.config["FLASKY_MAIL_WORKERS"]
+        if not workers:
+            return False
+        with self._lock:
+            # fork出的worker进程中没有父进程的线程
+            if self._pid != os.getpid():
+                self._threads, self._pid = [], os.getpid()
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < workers:
+                thread = Thread(target=self._run, args=[app], daemon=True,
+                                name="mail-outbox-%d" % len(self._threads))
+                thread.start()
+                self._threads.append(thread)
+        return True
+
+    def notify(self, app):
+        """有新邮件时调用, 需要时启动发送线程并唤醒它们"""
+        if self.start(app):
+            self._wakeup.set()
+
+    def depth(self):
+        """发件箱中等待发送和已经放弃的邮件数量"""
+        table = OutboxMessage.__table__
+        rows = db.engine.execute(db.select([table.c.failed, db.func.count()]).group_by(table.c.failed))
+        counts = {bool(failed): count for failed, count in rows}
+        return {"pending": counts.get(False, 0), "failed": counts.get(True, 0)}
+
+    def drain(self):
+        """在当前线程中发送所有到期的邮件, 返回处理的数量"""
+        connection = None
+        total = 0
+        try:
+            while True:
+                processed, connection = self._deliver_batch(connection)
+                if not processed:
+                    return total
+                total += processed
+        finally:
+            self._close(connection)
+
+    def _run(self, app):
+        with app.app_context():
+            connection = None
+            idle_since = time.monotonic()
+            while True:
+                try:
+                    processed, connection = self._deliver_batch(connection)
+                except Exception:
+                    app.logger.exception("mail outbox worker failed")
+                    processed, connection = 0, self._close(connection)
+                if processed:
+                    idle_since = time.monotonic()
+                    continue
+                if connection is not None and time.monotonic() - idle_since > app.config["FLASKY_MAIL_IDLE_TIMEOUT"]:
+                    connection = self._close(connection)
+                self._wakeup.wait(app.config["FLASKY_MAIL_POLL_INTERVAL"])
+                self._wakeup.clear()
+
+    def _claim(self):
+        """取出一批到期的邮件, 用条件UPDATE抢占, 多个线程或进程不会重复发送"""
+        config = current_app.config
+        table = OutboxMessage.__table__
+        now = datetime.datetime.utcnow()
+        lease_until = now + datetime.timedelta(seconds=config["FLASKY_MAIL_LEASE"])
+        due = (table.c.failed == False) & (table.c.next_attempt_at <= now)
+        ids = [row.id for row in db.engine.execute(
+            db.select([table.c.id]).where(due).order_by(table.c.id).limit(config["FLASKY_MAIL_BATCH_SIZE"]))]
+        claimed = [id for id in ids
+                   if db.engine.execute(table.update().where(due & (table.c.id == id))
+                                                      .values(next_attempt_at=lease_until)).rowcount == 1]
+        if not claimed:
+            return []
+        return db.engine.execute(table.select().where(table.c.id.in_(claimed)).order_by(table.c.id)).fetchall()
+
+    def _deliver_batch(self, connection):
+        rows = self._claim()
+        for row in rows:
+            msg = Message(row.subject, sender=row.sender, recipients=[row.recipient], body=row.body, html=row.html)
+            try:
+                connection = self._send(connection, msg)
+            except (smtplib.SMTPException, OSError) as e:
+                # 连接可能已经不可用, 下一封邮件重新连接
+                connection = self._close(connection)
+                self._retry_later(row, e)
+            else:
+                table = OutboxMessage.__table__
+                db.engine.execute(table.delete().where(table.c.id == row.id))
+        return len(rows), connection
+
+    def _send(self, connection, msg):
+        """用已有的连接发送, 返回使用的连接
+        服务器在空闲时断开了连接不算发送失败, 重新连接一次再发送"""
+        if connection is not None:
+            try:
+                connection.send(msg)
+                return connection
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._close(connection)
+        connection = mail.connect().__enter__()
+        connection.send(msg)
+        return connection
+
+    def _retry_later(self, row, error):
+        config = current_app.config
+        table = OutboxMessage.__table__
+        attempts = row.attempts + 1
+        delay = min(config["FLASKY_MAIL_RETRY_BACKOFF"] * 2 ** (attempts - 1), config["FLASKY_MAIL_RETRY_MAX_DELAY"])
+        db.engine.execute(table.update().where(table.c.id == row.id).values(
+            attempts=attempts, failed=attempts >= config["FLASKY_MAIL_MAX_ATTEMPTS"],
+            next_attempt_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=delay),
+            last_error=str(error)[:256],
+        ))
+        current_app.logger.warning("sending mail %d to %s failed (attempt %d): %s",
+                                   row.id, row.recipient, attempts, error)
+
+    @staticmethod
+    def _close(connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+
+outbox = Outbox()
@@ -0,0 +1,18 @@
+from markupsafe import Markup
+
+from .cache import LRUCache
+
+
+# 模板片段缓存, 容量在create_app中按FLASKY_FRAGMENT_CACHE_SIZE设置
+fragment_cache = LRUCache(maxsize=4096)
+
+
+def cache_fragment(*key, caller):
+    """在模板中用{% call cache_fragment("post", post.id, post.version) %}...{% endcall %}缓存一段html
+    键中应包含片段所依赖数据的版本号; 与当前用户有关的内容放在片段之外"""
+    key = ":".join(str(part) for part in key)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = str(caller())
+        fragment_cache.set(key, html)
+    return Markup(html)
@@ -0,0 +1,75 @@
+from sqlalchemy import bindparam
+
+from .cache import LRUCache
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+
+class LastSeenBuffer:
+    """在内存中合并用户的最近访问时间, 每隔一段时间或攒够一定数量的用户后用一条批量UPDATE写入
+    每个worker进程一个缓冲区, 请求中不再为了last_seen提交事务
+    后台线程按flush_interval定时写入, 访问量很小时缓冲的时间也不会一直等到下一次访问"""
+    def __init__(self, table):
+        self.table = table
+        self._update = table.update().where(table.c.id == bindparam("user_id"))\
+                                     .values(last_seen=bindparam("seen"))
+        self._pending = {}   # user_id -> 最近访问时间
+        self._recorded = LRUCache(maxsize=10000)   # user_id -> 最近一次记录的时间, 用于控制更新粒度
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._engine = None
+        self._flush_interval = 30
+        self._flusher_pid = None
+        atexit.register(self.flush)
+
+    def touch(self, user_id, when, engine, granularity=60, flush_interval=30, flush_size=100):
+        """记录用户在when时访问过, 距上次记录不足granularity秒时忽略"""
+        recorded = self._recorded.get(user_id)
+        if recorded is not None and (when - recorded).total_seconds() < granularity:
+            return
+        self._recorded.set(user_id, when)
+        with self._lock:
+            self._engine = engine
+            self._flush_interval = flush_interval
+            self._pending[user_id] = when
+            self._start_flusher()
+            if len(self._pending) < flush_size and time.monotonic() - self._last_flush < flush_interval:
+                return
+            batch, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        self._write(engine, batch)
+
+    def _start_flusher(self):
+        # 每个进程第一次记录时启动, fork出的worker不会继承父进程的线程; 调用时持有self._lock
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run, name="last-seen-flusher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self._flush_interval)
+            if self._pending and time.monotonic() - self._last_flush >= self._flush_interval:
+                try:
+                    self.flush()
+                except Exception:
+                    logging.getLogger(__name__).exception("flushing last_seen failed")
+
+    def flush(self):
+        """立即写入所有缓冲的时间, 进程退出时也会调用"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            engine = self._engine
+        if batch and engine is not None:
+            self._write(engine, batch)
+
+    def _write(self, engine, batch):
+        engine.execute(self._update, [{"user_id": user_id, "seen": seen} for user_id, seen in batch.items()])
+
+    def __len__(self):
+        return len(self._pending)
@@ -3,14 +3,26 @@ from flask_login import login_required, current_user
 from flask_sqlalchemy import get_debug_queries
 
 from .. import db
-from ..models import User, Role, Permission, Post, Comment
+from ..models import User, Role, Permission, Post, Comment, Timeline, Follow
+from ..exceptions import ValidationError
+from ..pagination import wants_keyset, cursor_args, paginate_keyset
 from ..email import send_email
 from ..decorators import admin_required, permission_required
+from ..page_cache import cached_page
 from . import main
 from .forms import NameForm, EditProfileForm, EditProfileAdminForm, PostForm, CommentForm
 
 
+def _paginate_keyset(query, columns, per_page, **kwargs):
+    """使用请求中的游标分页, 游标不正确时返回400"""
+    try:
+        return paginate_keyset(query, columns, per_page, **cursor_args(), **kwargs)
+    except ValidationError:
+        abort(400)
+
+
 @main.route("/", methods=["GET", "POST"])
+@cached_page("posts")
 def index():
     """首页显示"""
     form = PostForm()
@@ -23,14 +35,20 @@ def index():
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get("show_followed", ""))
     if show_followed:
-        query = current_user.followed_posts
+        query = current_user.followed_posts   # 已按时间线排好序
+        columns = (Timeline.timestamp, Timeline.post_id)
     else:
-        query = Post.query
+        query = Post.query.order_by(Post.timestamp.desc())
+        columns = (Post.timestamp, Post.id)
+    query = query.options(db.joinedload(Post.author))   # 模板中每篇文章都会用到作者, 一并查出
     # 使用分页
-    page = request.args.get("page", 1, type=int)
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config["FLASKY_POST_PER_PAGE"], error_out=False
-    )
+    if wants_keyset():
+        pagination = _paginate_keyset(query, columns, current_app.config["FLASKY_POST_PER_PAGE"])
+    else:
+        page = request.args.get("page", 1, type=int)
+        pagination = query.paginate(
+            page, per_page=current_app.config["FLASKY_POST_PER_PAGE"], error_out=False
+        )
     posts = pagination.items
     return render_template("index.html", form=form, posts=posts, pagination=pagination, show_followed=show_followed)
 
@@ -54,13 +72,19 @@ def show_followed():
 
 
 @main.route("/user/<username>")
+@cached_page("posts", "users", "follows")
 def user(username):
     """用户资料页"""
     user = User.query.filter_by(username=username).first()
     if user is None:
         abort(404)
-    posts = user.posts.order_by(Post.timestamp.desc()).all()
-    return render_template("user.html", user=user, posts=posts)
+    query = user.posts.order_by(Post.timestamp.desc())   # 作者就是user, 已在identity map中, 不会再查询
+    if wants_keyset():
+        pagination = _paginate_keyset(query, (Post.timestamp, Post.id), current_app.config["FLASKY_POST_PER_PAGE"])
+    else:
+        page = request.args.get("page", 1, type=int)
+        pagination = query.paginate(page, per_page=current_app.config["FLASKY_POST_PER_PAGE"], error_out=False)
+    return render_template("user.html", user=user, posts=pagination.items, pagination=pagination)
 
 
 @main.route("/edit-profile", methods=["GET", "POST"])
@@ -90,7 +114,11 @@ def edit_profile_admin(id):
     user = User.query.get_or_404(id)
     form = EditProfileAdminForm(user=user)
     if form.validate_on_submit():
-        user.email = form.email.data
+        if user.email != form.email.data:
+            user.email = form.email.data
+            user.avatar_hash = user.gravatar_hash()   # 更新头像hash缓存
+        if user.confirmed != form.confirmed.data or user.role_id != form.role.data:
+            user.revoke_tokens()   # API令牌中带有确认状态和权限, 改变后需要重新获取
         user.username = form.username.data
         user.confirmed = form.confirmed.data
         user.role = Role.query.get(form.role.data)
@@ -112,6 +140,7 @@ def edit_profile_admin(id):
 
 
 @main.route("/post/<int:id>", methods=["GET", "POST"])
+@cached_page("post:{id}", "users")
 def post(id):
     """在单独的页面显示文章"""
     post = Post.query.get_or_404(id)
@@ -127,11 +156,10 @@ def post(id):
         return redirect(url_for(".post", id=post.id, page=-1))   # -1显示最后一页, 提交成功后将会自动定位到最后一页评论
     page = request.args.get("page", 1, type=int)
     if page == -1:   # 设定特定页数-1的处理方式
-        page = (post.comments.count()-1) // current_app.config["FLASKY_COMMENTS_PER_PAGE"] + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(page, 
-                                                                          per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"],
-                                                                          error_out=False
-                                                                )
+        page = (post.comment_count-1) // current_app.config["FLASKY_COMMENTS_PER_PAGE"] + 1
+    pagination = post.comments.options(db.joinedload(Comment.author)).order_by(Comment.timestamp.asc()).paginate(
+        page, per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"], error_out=False
+    )
     comments = pagination.items
     return render_template("post.html", posts=[post], form=form, comments=comments, pagination=pagination)
 
@@ -198,10 +226,15 @@ def followers(username):
         flash("Invalid user.")
         return redirect(url_for(".index"))
     # 当前用户关注的
-    page = request.args.get("page", 1, type=int)
-    pagination = user.followers.paginate(
-        page, per_page=current_app.config["FLASKY_FOLLOWERS_PER_PAGE"], error_out=False
-    )
+    if wants_keyset():
+        pagination = _paginate_keyset(user.followers, (Follow.timestamp, Follow.follower_id),
+                                      current_app.config["FLASKY_FOLLOWERS_PER_PAGE"],
+                                      key=lambda item: (item.timestamp, item.follower_id))
+    else:
+        page = request.args.get("page", 1, type=int)
+        pagination = user.followers.paginate(
+            page, per_page=current_app.config["FLASKY_FOLLOWERS_PER_PAGE"], error_out=False
+        )
     follows = [{"user": item.follower, "timestamp": item.timestamp} for item in pagination.items]
     return render_template("followers.html", user=user, title="Followers of", endpoint=".followers",
                             pagination=pagination, follows=follows)
@@ -215,10 +248,15 @@ def followed_by(username):
         flash("Invalid user.")
         return redirect(url_for(".index"))
     # 关注当前用户的
-    page = request.args.get("page", 1, type=int)
-    pagination = user.followed.paginate(
-        page, per_page=current_app.config["FLASKY_FOLLOWERS_PER_PAGE"], error_out=False
-    )
+    if wants_keyset():
+        pagination = _paginate_keyset(user.followed, (Follow.timestamp, Follow.followed_id),
+                                      current_app.config["FLASKY_FOLLOWERS_PER_PAGE"],
+                                      key=lambda item: (item.timestamp, item.followed_id))
+    else:
+        page = request.args.get("page", 1, type=int)
+        pagination = user.followed.paginate(
+            page, per_page=current_app.config["FLASKY_FOLLOWERS_PER_PAGE"], error_out=False
+        )
     follows = [{"user": item.followed, "timestamp": item.timestamp} for item in pagination.items]
     return render_template("followers.html", user=user, title="Followed by", endpoint=".followed_by",
                             pagination=pagination, follows=follows)
@@ -230,11 +268,16 @@ def followed_by(username):
 def moderate():
     """获取评论"""
     page = request.args.get("page", 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page,
-        per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"],
-        error_out=False
-    )
+    query = Comment.query.options(db.joinedload(Comment.author), db.joinedload(Comment.post))
+    if wants_keyset():
+        pagination = _paginate_keyset(query, (Comment.timestamp, Comment.id),
+                                      current_app.config["FLASKY_COMMENTS_PER_PAGE"])
+    else:
+        pagination = query.order_by(Comment.timestamp.desc()).paginate(
+            page,
+            per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"],
+            error_out=False
+        )
     comments = pagination.items
     return render_template("moderate.html", comments=comments, pagination=pagination, page=page)
 
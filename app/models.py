@@ -1,14 +1,22 @@
-from flask import current_app, request, url_for
+from flask import current_app, request, url_for, has_app_context
 from flask_login import UserMixin, AnonymousUserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from markdown import markdown
-import bleach
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
 
 from . import db, login_manager
 from app.exceptions import ValidationError
+from app.render import set_body_html, queue_render
+from app.last_seen import LastSeenBuffer
+from app.cache import LRUCache, credential_cache
+from app.tokens import generate_token, verify_token, revocation_list
+from app.page_cache import record_page_changes, counter_tags
 
+from collections import namedtuple
 import datetime
+import functools
 import hashlib
 
 
@@ -99,6 +107,12 @@ class User(db.Model, UserMixin):
     last_seen = db.Column(db.DateTime(), default=datetime.datetime.utcnow)
     # 头像hash缓存
     avatar_hash = db.Column(db.String(32))
+    # 计数缓存, 通过事件维护, 可用reconcile_counters修复
+    post_count = db.Column(db.Integer, default=0, server_default="0")
+    followers_count = db.Column(db.Integer, default=0, server_default="0")   # 关注该用户的人数
+    followed_count = db.Column(db.Integer, default=0, server_default="0")   # 该用户关注的人数
+    # API令牌的代数, 修改密码等操作时加一, 之前签发的令牌全部作废
+    token_generation = db.Column(db.Integer, default=0, server_default="0")
     posts = db.relationship("Post", backref="author", lazy="dynamic")   # 关联Post
     # 关注者, 都是只涉及User表, 属于自引用关系
     followed = db.relationship("Follow",    # 被当前账号关注的
@@ -138,10 +152,33 @@ class User(db.Model, UserMixin):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
+        if self.id is not None:
+            credential_cache.invalidate_user(self.id)   # API中缓存的旧密码验证结果失效
+            self.revoke_tokens()
+
+    def revoke_tokens(self):
+        """作废该用户已经签发的全部API令牌
+        本进程立即生效(即使事务随后回滚也只是提前作废), 其他进程在下次刷新作废列表时生效"""
+        self.token_generation = (self.token_generation or 0) + 1
+        revocation_list.revoke(self.id, self.token_generation)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """验证密码, 成功且hash不符合当前的策略时用这次的明文重新生成hash"""
+        if not check_password_hash(self.password_hash, password):
+            return False
+        if self.id is not None and has_app_context() and password_needs_rehash(self.password_hash):
+            self.rehash_password(password)
+        return True
+
+    def rehash_password(self, password):
+        """直接写入新的hash, 不经过session, 登录的请求中不需要提交事务
+        只在hash没有被其他请求修改时写入, 令牌和密码验证缓存都不受影响"""
+        new_hash = hash_password(password)
+        table = User.__table__
+        db.engine.execute(table.update().where((table.c.id == self.id) & (table.c.password_hash == self.password_hash))
+                                        .values(password_hash=new_hash))
+        set_committed_value(self, "password_hash", new_hash)
 
     def generate_confirmation_token(self, expiration=3600):
         """确认用户注册邮箱, 生成用户令牌"""
@@ -168,10 +205,13 @@ class User(db.Model, UserMixin):
         return self.can(Permission.ADMIN)
     
     def ping(self):
-        """每次登录更新时间, 将会注册到before_request钩子中, 使用current_user来进行检查"""
-        self.last_seen = datetime.datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
+        """每次登录更新时间, 将会注册到before_request钩子中, 使用current_user来进行检查
+        时间先放入last_seen_buffer, 由它合并后批量写入, 不在请求中提交事务"""
+        config = current_app.config
+        last_seen_buffer.touch(self.id, datetime.datetime.utcnow(), db.engine,
+                               granularity=config["FLASKY_LAST_SEEN_GRANULARITY"],
+                               flush_interval=config["FLASKY_LAST_SEEN_FLUSH_INTERVAL"],
+                               flush_size=config["FLASKY_LAST_SEEN_FLUSH_SIZE"])
 
     def gravatar_hash(self):
         return hashlib.md5(self.email.lower().encode("U8")).hexdigest()
@@ -182,10 +222,30 @@ class User(db.Model, UserMixin):
         r图像级别 
         d尚未注册的用户使用的默认图像生成方式
         fd强制使用默认头像"""
-        url = "https://secure.gravatar.com/avatar"
-        md5_str = self.gravatar_hash()
-        return "{url}/{md5_str}?s={size}&d={default}&r={rating}".format(
-                url=url, md5_str=md5_str, size=size, default=default, rating=rating)
+        md5_str = self.avatar_hash or self.gravatar_hash()   # 优先使用数据库中缓存的hash
+        return gravatar_url(md5_str, size, default, rating)
+
+    @staticmethod
+    def backfill_avatar_hashes(chunk_size=500):
+        """为avatar_hash为空的用户批量生成头像hash, 返回更新的用户数"""
+        users = User.__table__
+        update = users.update().where(users.c.id == db.bindparam("user_id"))\
+                               .values(avatar_hash=db.bindparam("avatar_hash"))
+        total = 0
+        while True:
+            rows = db.session.query(User.id, User.email)\
+                             .filter(User.avatar_hash.is_(None), User.email.isnot(None))\
+                             .order_by(User.id).limit(chunk_size).all()
+            if not rows:
+                break
+            db.session.execute(update, [
+                {"user_id": id, "avatar_hash": hashlib.md5(email.lower().encode("U8")).hexdigest()}
+                for id, email in rows
+            ])
+            db.session.commit()
+            total += len(rows)
+        identity_cache.clear()   # 缓存的身份中可能还是空的hash
+        return total
 
     def follow(self, user):
         """关注某个用户"""
@@ -214,10 +274,12 @@ class User(db.Model, UserMixin):
     @property
     def followed_posts(self):
         # select * from Post 
-        # join Follow on Follow.followed_id=Post.author_id 
-        # join User on User.id = Follow.follower_id
-        # where User.id = ;
-        return Post.query.join(Follow, Follow.followed_id == Post.author_id).filter(Follow.follower_id == self.id)
+        # join Timeline on Timeline.post_id = Post.id 
+        # where Timeline.user_id = 
+        # order by Timeline.timestamp desc;
+        # 直接读取物化的时间线表, 按(user_id, timestamp)索引做一次范围扫描, 不再对follows做联结排序
+        return Post.query.join(Timeline, Timeline.post_id == Post.id).filter(Timeline.user_id == self.id)\
+                         .order_by(Timeline.timestamp.desc(), Timeline.post_id.desc())
     
     @staticmethod
     def add_self_follows():
@@ -229,21 +291,19 @@ class User(db.Model, UserMixin):
                 db.session.commit()
     
     def generate_auth_token(self, expiration):
-        """生成用于API的令牌, 使用用户的id"""
-        s = Serializer(current_app.config["SECRET_KEY"], expires_in=expiration)
-        return s.dumps({"user's id token": self.id}).decode("U8")
+        """生成用于API的令牌, 令牌中带有用户的id, 确认状态和权限"""
+        return generate_token(self, expiration)
 
     @staticmethod
     def verify_auth_token(token):
         """用于API的令牌验证, 通过解码的id获取到用户对象"""
-        s = Serializer(current_app.config["SECRET_KEY"])
-        try:
-            data = s.loads(token)
-        except:
+        identity = verify_token(token)
+        if identity is None:
             return None
-        return User.query.get(data["user's id token"])
+        return load_cached_user(identity.id)
 
     def to_json(self):
+        # 与API输出的字段相同; API中直接序列化查询出的列, 不经过模型对象
         json_user = {
             "url": url_for("api.get_user", id=self.id),
             "username": self.username,
@@ -251,11 +311,52 @@ class User(db.Model, UserMixin):
             "last_seen": self.last_seen,
             "posts_url": url_for("api.get_user_posts", id=self.id),
             "followd_posts_url": url_for("api.get_user_followed_posts", id=self.id),
-            "post_count": self.posts.count()
+            "post_count": self.post_count
         }
         return json_user
 
 
+last_seen_buffer = LastSeenBuffer(User.__table__)
+
+
+@functools.lru_cache(maxsize=4096)
+def gravatar_url(md5_str, size=100, default="identicon", rating="g"):
+    """按(hash, 尺寸, 默认图像, 级别)缓存生成的头像链接, 同一进程中只格式化一次"""
+    url = "https://secure.gravatar.com/avatar"
+    return "{url}/{md5_str}?s={size}&d={default}&r={rating}".format(
+            url=url, md5_str=md5_str, size=size, default=default, rating=rating)
+
+
+def password_hash_method():
+    """当前配置的密码hash方法, 格式与generate_password_hash的method参数相同"""
+    if not has_app_context():
+        return "pbkdf2:sha256"
+    return "pbkdf2:%s:%d" % (current_app.config["FLASKY_PASSWORD_HASH_ALGORITHM"],
+                             current_app.config["FLASKY_PASSWORD_HASH_ITERATIONS"])
+
+
+def hash_password(password):
+    salt_length = current_app.config["FLASKY_PASSWORD_SALT_LENGTH"] if has_app_context() else 8
+    return generate_password_hash(password, method=password_hash_method(), salt_length=salt_length)
+
+
+def password_needs_rehash(password_hash):
+    """hash使用的方法或迭代次数与当前配置不同时返回True"""
+    method = password_hash.split("$", 1)[0]
+    if method.count(":") == 1:   # 旧的werkzeug没有写入迭代次数
+        method = "%s:%d" % (method, DEFAULT_PBKDF2_ITERATIONS)
+    return method != password_hash_method()
+
+
+def on_changed_email(target, value, oldvalue, initiator):
+    """修改邮箱后, 以旧邮箱缓存的API密码验证结果失效"""
+    if target.id is not None and value != oldvalue:
+        credential_cache.invalidate_user(target.id)
+
+
+db.event.listen(User.email, "set", on_changed_email)
+
+
 class AnonymousUser(AnonymousUserMixin):
     def can(self, permissions):
         return False
@@ -267,14 +368,88 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser   # 重新将匿名用户指向, 这是一个flask_login.AnonymousUser的子类, 增加了权限的判断方法
 
 
+class UserIdentity(namedtuple("UserIdentity", "id username confirmed role_id permissions avatar_hash")):
+    """缓存在worker进程中的精简用户身份, permissions为角色的权限位"""
+    __slots__ = ()
+
+    def can(self, perm):
+        return self.permissions is not None and self.permissions & perm == perm
+
+
+# 用户身份缓存, 容量和过期时间在create_app中按配置设置
+identity_cache = LRUCache(maxsize=10000, ttl=60)
+
+
+def _detached(cls, **values):
+    """不经过__init__构造一个已持久化但不在session中的对象, 没有给出的列会在第一次访问时再加载"""
+    obj = cls.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(obj, key, value)
+    make_transient_to_detached(obj)
+    return obj
+
+
+def load_cached_user(user_id):
+    """优先使用缓存的身份还原用户和角色对象, 命中时不查询数据库
+    角色对象一并放入session, 之后的user.role和can()也不会再查询"""
+    identity = identity_cache.get(user_id)
+    if identity is None:
+        user = User.query.get(user_id)
+        if user is not None:
+            identity_cache.set(user_id, UserIdentity(
+                user.id, user.username, user.confirmed, user.role_id,
+                user.role.permissions if user.role is not None else None, user.avatar_hash))
+        return user
+    role = None
+    if identity.role_id is not None:
+        role = _detached(Role, id=identity.role_id, permissions=identity.permissions)
+    return db.session.merge(_detached(User, id=identity.id, username=identity.username,
+                                      confirmed=identity.confirmed, role_id=identity.role_id,
+                                      avatar_hash=identity.avatar_hash, role=role), load=False)
+
+
+def collect_identity_changes(session, flush_context):
+    """记录这次flush中修改过的用户和角色, 等事务提交后再让缓存失效"""
+    changed = session.info.setdefault("identity_changes", set())
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, User) and obj.id is not None:
+            changed.add(obj.id)
+        elif isinstance(obj, Role):
+            changed.add(Role)
+
+
+def invalidate_identities(session):
+    changed = session.info.pop("identity_changes", ())
+    if Role in changed:
+        identity_cache.clear()   # 角色很少修改, 直接清空
+        return
+    for user_id in changed:
+        identity_cache.delete(user_id)
+
+
+def discard_identity_changes(session):
+    session.info.pop("identity_changes", None)
+
+
+db.event.listen(db.session, "after_flush", collect_identity_changes)
+db.event.listen(db.session, "after_commit", invalidate_identities)
+db.event.listen(db.session, "after_rollback", discard_identity_changes)
+
+
 @login_manager.user_loader
 def load_user(user_id):
     """flask_login扩展需要从数据库中获取指定标识符对应的用户时将会调用"""
-    return User.query.get(int(user_id))
+    return load_cached_user(int(user_id))
 
 
 ### 博客文章相关数据库 ###
 
+def bump_version(mapper, connection, target):
+    """行的列被修改时版本加一, 在数据库中计算, 不依赖内存中可能过期的版本"""
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = type(target).version + 1
+
+
 class Post(db.Model):
     __tablename__ = "posts"
     id = db.Column(db.Integer, primary_key=True)
@@ -282,14 +457,14 @@ class Post(db.Model):
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))   # 关联User中的主键
+    comment_count = db.Column(db.Integer, default=0, server_default="0")   # 评论数缓存
+    version = db.Column(db.Integer, default=1, server_default="1")   # 每次修改加一, 用于API的ETag
     # 关联评论, 一对多
     comments = db.relationship("Comment", backref="post", lazy="dynamic")
     
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ["a", "abbr", "acronym", "b", "blockquote", "code", "em", "i", "li",
-                        "ol", "pre", "strong", "ul", "h1", "h2", "h3", "p"]
-        target.body_html = bleach.linkify(bleach.clean(markdown(value, output_format="html"), tags=allowed_tags, strip=True))
+        set_body_html(target, value, "post")
     
     def to_json(self):
         json_post = {
@@ -299,7 +474,7 @@ class Post(db.Model):
             "timestamp": self.timestamp,
             "author_url": url_for("api.get_user", id=self.author_id),
             "comments_url": url_for("api.get_post_comments", id=self.id),
-            "comment_count": self.comments.count()
+            "comment_count": self.comment_count
         }
         return json_post
 
@@ -312,6 +487,9 @@ class Post(db.Model):
 
 
 db.event.listen(Post.body, "set", Post.on_changed_body)   # 监听发生在Post.body上的set事件, 并使用指定的函数再处理
+db.event.listen(Post, "before_update", bump_version)
+db.event.listen(Post, "after_insert", queue_render)   # 异步渲染时, 写入数据库后才知道id
+db.event.listen(Post, "after_update", queue_render)
 
 
 ### 评论相关数据库 ###
@@ -325,16 +503,13 @@ class Comment(db.Model):
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))   # User表中id的外键
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))   # Post表中id的外键
+    version = db.Column(db.Integer, default=1, server_default="1")   # 每次修改加一, 用于API的ETag
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ["a", "abbr", "acronym", "b", "code", "em", "i"]
-        target.body_html = bleach.linkify(bleach.clean(markdown(value, output_format="html"), 
-                                                       tags=allowed_tags, 
-                                                       strip=True)
-                                                       )
+        set_body_html(target, value, "comment")
     
-    def to_josn(self):
+    def to_json(self):
         json_comment = {
             "url": url_for("api.get_comment", id=self.id),
             "body": self.body,
@@ -354,3 +529,171 @@ class Comment(db.Model):
 
 
 db.event.listen(Comment.body, "set", Comment.on_changed_body)
+db.event.listen(Comment, "before_update", bump_version)
+db.event.listen(Comment, "after_insert", queue_render)
+db.event.listen(Comment, "after_update", queue_render)
+
+
+### 时间线相关数据库 ###
+
+class Timeline(db.Model):
+    """物化的首页时间线, 每行表示某个用户的时间线中有某篇文章
+    发布文章时写入所有关注者的时间线(写扩散), 关注/取消关注时补充或移除对应作者的文章"""
+    __tablename__ = "timelines"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)   # 时间线所属的用户
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), primary_key=True)   # 时间线中的文章
+    timestamp = db.Column(db.DateTime)   # 冗余文章的发布时间, 用于排序
+    __table_args__ = (
+        db.Index("ix_timelines_user_timestamp", "user_id", "timestamp", "post_id"),
+    )
+
+    @staticmethod
+    def on_post_insert(mapper, connection, target):
+        """新文章写入作者所有关注者的时间线"""
+        connection.execute(Timeline.__table__.insert().from_select(
+            ["user_id", "post_id", "timestamp"],
+            db.select([Follow.follower_id,
+                       db.literal(target.id, db.Integer),
+                       db.literal(target.timestamp, db.DateTime)]).where(Follow.followed_id == target.author_id)
+        ))
+
+    @staticmethod
+    def on_post_update(mapper, connection, target):
+        """文章发布时间被修改时同步时间线中的冗余时间"""
+        if db.inspect(target).attrs.timestamp.history.has_changes():
+            connection.execute(Timeline.__table__.update().where(Timeline.post_id == target.id)
+                                                          .values(timestamp=target.timestamp))
+
+    @staticmethod
+    def on_post_delete(mapper, connection, target):
+        """删除文章前先从所有时间线中移除"""
+        connection.execute(Timeline.__table__.delete().where(Timeline.post_id == target.id))
+
+    @staticmethod
+    def on_follow_insert(mapper, connection, target):
+        """关注后把被关注者已有的文章补充到关注者的时间线"""
+        connection.execute(Timeline.__table__.insert().from_select(
+            ["user_id", "post_id", "timestamp"],
+            db.select([db.literal(target.follower_id, db.Integer), Post.id, Post.timestamp])
+              .where(Post.author_id == target.followed_id)
+        ))
+
+    @staticmethod
+    def on_follow_delete(mapper, connection, target):
+        """取消关注后从关注者的时间线中移除被关注者的文章"""
+        connection.execute(Timeline.__table__.delete().where(db.and_(
+            Timeline.user_id == target.follower_id,
+            Timeline.post_id.in_(db.select([Post.id]).where(Post.author_id == target.followed_id))
+        )))
+
+    @staticmethod
+    def rebuild(user=None):
+        """依据follows和posts重新生成时间线, 不指定用户时重建全部"""
+        timelines = Timeline.__table__
+        delete = timelines.delete()
+        select = db.select([Follow.follower_id, Post.id, Post.timestamp])\
+                   .select_from(db.join(Follow.__table__, Post.__table__, Follow.followed_id == Post.author_id))
+        if user is not None:
+            delete = delete.where(timelines.c.user_id == user.id)
+            select = select.where(Follow.follower_id == user.id)
+        db.session.execute(delete)
+        db.session.execute(timelines.insert().from_select(["user_id", "post_id", "timestamp"], select))
+        db.session.commit()
+
+
+db.event.listen(Post, "after_insert", Timeline.on_post_insert)
+db.event.listen(Post, "after_update", Timeline.on_post_update)
+db.event.listen(Post, "before_delete", Timeline.on_post_delete)
+db.event.listen(Follow, "after_insert", Timeline.on_follow_insert)
+db.event.listen(Follow, "after_delete", Timeline.on_follow_delete)
+
+
+### 计数缓存 ###
+
+def _change_counter(connection, column, id, delta):
+    """在flush中直接对计数列加减, 不经过ORM对象"""
+    values = {column.name: db.func.coalesce(column, 0) + delta}
+    if "version" in column.table.c:   # 计数出现在API的输出中, 需要改变ETag
+        values["version"] = column.table.c.version + 1
+    connection.execute(column.table.update().where(column.table.c.id == id).values(values))
+    record_page_changes(db.session(), counter_tags(column, id))   # 事务提交后让显示计数的页面失效
+
+
+def on_post_insert_count(mapper, connection, target):
+    _change_counter(connection, User.__table__.c.post_count, target.author_id, 1)
+
+
+def on_post_delete_count(mapper, connection, target):
+    _change_counter(connection, User.__table__.c.post_count, target.author_id, -1)
+
+
+def on_comment_insert_count(mapper, connection, target):
+    _change_counter(connection, Post.__table__.c.comment_count, target.post_id, 1)
+
+
+def on_comment_delete_count(mapper, connection, target):
+    _change_counter(connection, Post.__table__.c.comment_count, target.post_id, -1)
+
+
+def on_follow_insert_count(mapper, connection, target):
+    _change_counter(connection, User.__table__.c.followers_count, target.followed_id, 1)
+    _change_counter(connection, User.__table__.c.followed_count, target.follower_id, 1)
+
+
+def on_follow_delete_count(mapper, connection, target):
+    _change_counter(connection, User.__table__.c.followers_count, target.followed_id, -1)
+    _change_counter(connection, User.__table__.c.followed_count, target.follower_id, -1)
+
+
+db.event.listen(Post, "after_insert", on_post_insert_count)
+db.event.listen(Post, "after_delete", on_post_delete_count)
+db.event.listen(Comment, "after_insert", on_comment_insert_count)
+db.event.listen(Comment, "after_delete", on_comment_delete_count)
+db.event.listen(Follow, "after_insert", on_follow_insert_count)
+db.event.listen(Follow, "after_delete", on_follow_delete_count)
+
+
+def reconcile_counters():
+    """用实际的行数批量修复计数缓存, 返回每个计数列被修复的行数"""
+    counters = (
+        (Post.comment_count, db.select([db.func.count(Comment.id)]).where(Comment.post_id == Post.id)),
+        (User.post_count, db.select([db.func.count(Post.id)]).where(Post.author_id == User.id)),
+        (User.followers_count, db.select([db.func.count()]).select_from(Follow.__table__)
+                                 .where(Follow.followed_id == User.id)),
+        (User.followed_count, db.select([db.func.count()]).select_from(Follow.__table__)
+                                .where(Follow.follower_id == User.id)),
+    )
+    repaired = {}
+    for column, count in counters:
+        count = count.as_scalar()
+        table = column.property.columns[0].table
+        values = {column.key: count}
+        if "version" in table.c:
+            values["version"] = table.c.version + 1
+        result = db.session.execute(table.update().values(values)
+                                                  .where(db.or_(column.is_(None), column != count)))
+        repaired["%s.%s" % (table.name, column.key)] = result.rowcount
+    if any(repaired.values()):
+        record_page_changes(db.session(), ("site",))   # 不知道是哪些行, 所有缓存的页面都失效
+    db.session.commit()
+    return repaired
+
+
+
+### 邮件发件箱 ###
+
+class OutboxMessage(db.Model):
+    """待发送的邮件, 由app.email中的发送线程取出发送, 发送成功后删除
+    next_attempt_at同时用作租约: 取出时推迟到租约到期, 发送线程中途退出的邮件会在到期后重新发送"""
+    __tablename__ = "mail_outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(128))
+    recipient = db.Column(db.String(64))
+    subject = db.Column(db.String(256))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    attempts = db.Column(db.Integer, default=0)   # 已经失败的次数
+    next_attempt_at = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow)
+    failed = db.Column(db.Boolean, default=False)   # 超过重试次数后不再发送, 保留以便排查
+    last_error = db.Column(db.String(256))
@@ -0,0 +1,113 @@
+from flask import current_app, request, session
+
+from . import cache, db
+
+import binascii
+import functools
+import os
+
+# 页面依赖的数据标签: posts表示文章列表(包括评论数), users表示用户资料, follows表示关注关系和关注数,
+# post:<id>表示一篇文章和它的评论; 所有页面都依赖site, 用于批量修复数据之后让全部页面失效
+GENERATION_KEY = "page_generation:%s"
+
+
+def _anonymous():
+    """没有会话和记住登录的cookie, 是匿名访问"""
+    return current_app.session_cookie_name not in request.cookies and \
+        current_app.config.get("REMEMBER_COOKIE_NAME", "remember_token") not in request.cookies
+
+
+def _page_key(tags):
+    """页面的缓存键由URL(含查询字符串)和所依赖标签的当前代号组成, 标签的代号改变后旧页面不再被命中"""
+    generations = [cache.get(GENERATION_KEY % tag) or "0" for tag in tags]
+    return "page:%s:%s" % (request.full_path, ":".join(generations))
+
+
+def cached_page(*tags):
+    """缓存匿名访客看到的整个GET响应, tags中可以使用URL参数, 如"post:{id}"
+    已登录或带有会话cookie的请求不经过缓存; 设置了cookie或修改了会话的响应不缓存"""
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_app.config["FLASKY_PAGE_CACHE"] or request.method != "GET" or not _anonymous():
+                return f(*args, **kwargs)
+            key = _page_key(["site"] + [tag.format(**kwargs) for tag in tags])
+            cached = cache.get(key)
+            if cached is not None:
+                status, headers, body = cached
+                response = current_app.response_class(body, status=status, headers=headers)
+                response.headers["X-Page-Cache"] = "hit"
+                return response
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed and not session.modified and \
+               "Set-Cookie" not in response.headers:
+                timeout = current_app.config["FLASKY_PAGE_CACHE_TIMEOUT"]
+                response.cache_control.public = True
+                response.cache_control.max_age = timeout
+                response.vary.add("Cookie")
+                cache.set(key, (response.status_code, list(response.headers), response.get_data()), timeout)
+                response.headers["X-Page-Cache"] = "miss"
+            return response
+        return decorated_function
+    return decorator
+
+
+def invalidate_pages(*tags):
+    """依赖这些标签的页面全部失效
+    代号只需保存一个页面缓存时间: 过期后标签回到"0", 而换代号之前按"0"缓存的页面此时都已过期"""
+    timeout = current_app.config["FLASKY_PAGE_CACHE_TIMEOUT"]
+    for tag in tags:
+        cache.set(GENERATION_KEY % tag, binascii.hexlify(os.urandom(4)).decode(), timeout)
+
+
+def page_tags(obj):
+    """修改obj会影响到的页面标签"""
+    from .models import User, Post, Comment, Follow
+    if isinstance(obj, Post):
+        return ("posts", "post:%s" % obj.id)
+    if isinstance(obj, Comment):
+        return ("posts", "post:%s" % obj.post_id)   # 文章列表中显示评论数
+    if isinstance(obj, User):
+        return ("users",)
+    if isinstance(obj, Follow):
+        return ("follows",)
+    return ()
+
+
+def counter_tags(column, id):
+    """直接用UPDATE修改的计数列会影响到的页面标签, 这些修改不会出现在session.dirty中"""
+    if column.table.name == "posts":
+        return ("posts", "post:%s" % id)
+    if column.key in ("followers_count", "followed_count"):
+        return ("follows",)
+    return ("posts",)   # 用户的文章数与文章列表一起变化
+
+
+def record_page_changes(session, tags):
+    """记录需要失效的标签, 等事务提交后再让页面失效"""
+    session.info.setdefault("page_changes", set()).update(tags)
+
+
+def collect_page_changes(session, flush_context):
+    """记录这次flush中修改过的文章, 评论, 用户和关注关系"""
+    for obj in session.new | session.deleted:
+        record_page_changes(session, page_tags(obj))
+    for obj in session.dirty:
+        # 新文章的作者会因为posts集合的改变出现在dirty中, 只有列被修改过才算修改
+        if session.is_modified(obj, include_collections=False):
+            record_page_changes(session, page_tags(obj))
+
+
+def invalidate_changed_pages(session):
+    changed = session.info.pop("page_changes", ())
+    if changed:
+        invalidate_pages(*changed)
+
+
+def discard_page_changes(session):
+    session.info.pop("page_changes", None)
+
+
+db.event.listen(db.session, "after_flush", collect_page_changes)
+db.event.listen(db.session, "after_commit", invalidate_changed_pages)
+db.event.listen(db.session, "after_rollback", discard_page_changes)
@@ -0,0 +1,197 @@
+from flask import current_app, request, url_for
+
+from . import db
+from .cache import LRUCache
+from .exceptions import ValidationError
+
+from threading import Lock, Thread
+import base64
+import datetime
+import time
+
+
+CURSOR_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def encode_cursor(timestamp, id):
+    """把(timestamp, id)编码为不透明的游标字符串"""
+    if timestamp is None or id is None:
+        raise ValueError("cannot build a cursor from a NULL sort key")
+    raw = "{}|{}".format(timestamp.strftime(CURSOR_TIME_FORMAT), id)
+    return base64.urlsafe_b64encode(raw.encode("U8")).decode("U8").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解码游标字符串, 格式不正确时抛出ValidationError"""
+    try:
+        raw = base64.urlsafe_b64decode((cursor + "=" * (-len(cursor) % 4)).encode("U8")).decode("U8")
+        timestamp, id = raw.split("|")
+        return datetime.datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(id)
+    except (ValueError, TypeError):
+        raise ValidationError("invalid pagination cursor")
+
+
+def wants_keyset():
+    """配置中开启了游标分页, 或请求中带有before/after游标时使用游标分页"""
+    return current_app.config["FLASKY_KEYSET_PAGINATION"] or \
+        "before" in request.args or "after" in request.args
+
+
+def cursor_args():
+    """从请求中取出before/after游标"""
+    return dict(before=request.args.get("before") or None, after=request.args.get("after") or None)
+
+
+def page_url(endpoint, **values):
+    """上一页或下一页的链接, 保留请求中除分页位置以外的参数(如fields, include, count)"""
+    args = request.args.to_dict(flat=False)
+    for name in ("page", "before", "after"):
+        args.pop(name, None)
+    args.update(values)
+    return url_for(endpoint, **args)
+
+
+class KeysetPagination:
+    """游标分页的结果, 属性与flask_sqlalchemy的Pagination保持相近, 模板中通过cursor_mode区分"""
+    cursor_mode = True
+
+    def __init__(self, items, per_page, has_prev, has_next, key):
+        self.items = items
+        self.per_page = per_page
+        self.has_prev = has_prev and bool(items)
+        self.has_next = has_next and bool(items)
+        self.prev_cursor = encode_cursor(*key(items[0])) if self.has_prev else None
+        self.next_cursor = encode_cursor(*key(items[-1])) if self.has_next else None
+
+
+def _beyond(columns, values, descending):
+    """(timestamp, id)按排序方向位于游标之后的条件, 展开写以兼容不支持行值比较的数据库"""
+    timestamp_column, id_column = columns
+    timestamp, id = values
+    if descending:
+        return (timestamp_column < timestamp) | ((timestamp_column == timestamp) & (id_column < id))
+    return (timestamp_column > timestamp) | ((timestamp_column == timestamp) & (id_column > id))
+
+
+def paginate_keyset(query, columns, per_page, before=None, after=None, descending=True, key=None):
+    """按(timestamp, id)做游标分页
+    columns: 排序使用的(时间列, id列), 需要有对应的联合索引
+    after: 取列表顺序中位于游标之后的一页, 即下一页
+    before: 取列表顺序中位于游标之前的一页, 即上一页
+    key: 从结果元素中取出(timestamp, id), 默认使用元素的timestamp和id属性
+    多取一行来判断是否还有更多的数据, 不执行COUNT, 深翻页的耗时与表的大小无关
+    时间为NULL的行无法生成游标, 也无法与游标比较, 不出现在游标分页的结果中"""
+    if key is None:
+        key = lambda item: (item.timestamp, item.id)
+    timestamp_column, id_column = columns
+    query = query.order_by(None).filter(timestamp_column.isnot(None))
+    if before is not None:
+        # 反向查询出游标之前的数据, 再翻转回列表的顺序
+        query = query.filter(_beyond(columns, decode_cursor(before), not descending))
+        if descending:
+            query = query.order_by(timestamp_column.asc(), id_column.asc())
+        else:
+            query = query.order_by(timestamp_column.desc(), id_column.desc())
+        items = query.limit(per_page + 1).all()
+        has_prev = len(items) > per_page
+        items = items[:per_page][::-1]
+        return KeysetPagination(items, per_page, has_prev, True, key)
+    if after is not None:
+        query = query.filter(_beyond(columns, decode_cursor(after), descending))
+    if descending:
+        query = query.order_by(timestamp_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(timestamp_column.asc(), id_column.asc())
+    items = query.limit(per_page + 1).all()
+    has_next = len(items) > per_page
+    return KeysetPagination(items[:per_page], per_page, after is not None, has_next, key)
+
+
+COUNT_MODES = ("exact", "cached", "none")
+
+
+def count_mode():
+    """列表总数的计算方式, 请求中的?count=优先于配置中的FLASKY_API_COUNT_MODE
+    exact: 每次执行COUNT; cached: 使用缓存的总数, 过期后在后台刷新; none: 不计算总数"""
+    mode = request.args.get("count") or current_app.config["FLASKY_API_COUNT_MODE"]
+    if mode not in COUNT_MODES:
+        raise ValidationError("count must be one of: %s" % ", ".join(COUNT_MODES))
+    return mode
+
+
+class CountCache:
+    """缓存列表的总数, 过期后先返回旧值, 同时在后台线程中重新计数, 请求不必等待COUNT"""
+    def __init__(self, maxsize=1024):
+        self._cache = LRUCache(maxsize=maxsize)
+        self._refreshing = set()
+        self._lock = Lock()
+
+    @staticmethod
+    def count_statement(query):
+        return db.select([db.func.count()]).select_from(query.order_by(None).statement.alias())
+
+    def get(self, key, query, ttl):
+        cached = self._cache.get(key)
+        if cached is None:
+            total = db.session.execute(self.count_statement(query)).scalar()
+            self._cache.set(key, (total, time.monotonic()))
+            return total
+        total, counted_at = cached
+        if time.monotonic() - counted_at > ttl:
+            self._refresh(key, self.count_statement(query))
+        return total
+
+    def _refresh(self, key, statement):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        thread = Thread(target=self._count, args=[current_app._get_current_object(), key, statement], daemon=True)
+        thread.start()
+
+    def _count(self, app, key, statement):
+        try:
+            with app.app_context():
+                total = db.engine.execute(statement).scalar()
+            self._cache.set(key, (total, time.monotonic()))
+        except Exception:
+            app.logger.exception("refreshing count %r failed", key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear(self):
+        self._cache.clear()
+
+
+count_cache = CountCache()
+
+
+class OffsetPagination:
+    """页码分页的结果, 总数没有计算时total为None"""
+    cursor_mode = False
+
+    def __init__(self, items, page, per_page, has_next, total):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_prev = page > 1
+        self.has_next = has_next
+        self.total = total
+
+
+def paginate_offset(query, page, per_page, count="exact", count_key=None):
+    """页码分页, 多取一行来判断是否还有下一页, 按count决定如何得到总数(见count_mode)
+    count为cached时count_key标识这个列表, 如("timeline", user_id)"""
+    page = max(page, 1)
+    items = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    has_next = len(items) > per_page
+    items = items[:per_page]
+    total = None
+    if count != "none" and not has_next and (items or page == 1):
+        total = (page - 1) * per_page + len(items)   # 最后一页, 不需要COUNT
+    elif count == "exact":
+        total = query.order_by(None).count()
+    elif count == "cached":
+        total = count_cache.get(count_key, query, current_app.config["FLASKY_COUNT_CACHE_TTL"])
+    return OffsetPagination(items, page, per_page, has_next, total)
@@ -0,0 +1,204 @@
+from flask import current_app, has_app_context
+from markdown import markdown
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+import bleach
+
+from . import db
+from .cache import LRUCache
+from .page_cache import page_tags, invalidate_pages
+
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import hashlib
+import os
+import threading
+
+
+# 文章和评论允许保留的html标签
+ALLOWED_TAGS = {
+    "post": ["a", "abbr", "acronym", "b", "blockquote", "code", "em", "i", "li",
+             "ol", "pre", "strong", "ul", "h1", "h2", "h3", "p"],
+    "comment": ["a", "abbr", "acronym", "b", "code", "em", "i"],
+}
+
+
+def render_html(body, profile):
+    """把markdown转换为html, 再按profile对应的标签白名单清理"""
+    return bleach.linkify(bleach.clean(markdown(body, output_format="html"),
+                                       tags=ALLOWED_TAGS[profile],
+                                       strip=True))
+
+
+# 渲染结果缓存, Post和Comment共用, 容量在create_app中按FLASKY_RENDER_CACHE_SIZE设置
+render_cache = LRUCache(maxsize=1024)
+
+
+def render_key(body, profile):
+    """以(原文, 标签白名单)的hash作为缓存键, 白名单改变后旧的结果自然失效"""
+    raw = "\0".join([profile, ",".join(ALLOWED_TAGS[profile]), body])
+    return hashlib.sha1(raw.encode("U8")).hexdigest()
+
+
+def render_html_cached(body, profile):
+    """先查渲染缓存, 未命中时渲染并放入缓存"""
+    key = render_key(body, profile)
+    html = render_cache.get(key)
+    if html is None:
+        html = render_html(body, profile)
+        render_cache.set(key, html)
+    return html
+
+
+class RenderPool:
+    """在进程池中渲染body_html, 完成后直接写回数据库
+    进程池在每个进程中第一次使用时创建; flush时先预留名额, 名额用完时由调用方同步渲染"""
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._condition = threading.Condition()
+
+    def executor(self, max_workers):
+        # gunicorn等fork出的worker不能沿用父进程的进程池
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def reserve(self, max_pending):
+        """预留一个渲染名额, 已满时返回False; 预留的名额由submit的写回或release归还"""
+        with self._condition:
+            if self._pending >= max_pending:
+                return False
+            self._pending += 1
+            return True
+
+    def release(self, count=1):
+        with self._condition:
+            self._pending -= count
+            self._condition.notify_all()
+
+    def submit(self, engine, table, id, body, profile, max_workers, tags=()):
+        """提交已经预留了名额的渲染, tags是写回后需要失效的页面标签"""
+        try:
+            future = self.executor(max_workers).submit(render_html, body, profile)
+        except Exception:
+            future = None
+        if future is None:
+            self._write_back(engine, table, id, body, profile, tags, None)
+        else:
+            future.add_done_callback(functools.partial(self._write_back, engine, table, id, body, profile, tags))
+
+    def _write_back(self, engine, table, id, body, profile, tags, future):
+        try:
+            try:
+                html = future.result()
+                render_cache.set(render_key(body, profile), html)
+            except Exception:
+                # 进程池不可用时退回到当前线程渲染
+                html = render_html_cached(body, profile)
+            # body在渲染期间又被修改过时不写回, 以最新的渲染结果为准
+            engine.execute(table.update().where((table.c.id == id) & (table.c.body == body))
+                                         .values(body_html=html, version=table.c.version + 1))
+            invalidate_pages(*tags)
+        finally:
+            self.release()
+
+    def join(self, timeout=None):
+        """等待所有已提交的渲染写回完成"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending == 0, timeout)
+
+
+render_pool = RenderPool()
+
+
+def set_body_html(target, value, profile):
+    """body被修改时生成body_html
+    开启FLASKY_ASYNC_RENDER时先把body_html置空(模板会显示body), 提交后交给进程池渲染
+    是否还有渲染名额在flush时(queue_render)判断, 没有写入数据库的对象不占用名额"""
+    if value is None:
+        target.body_html = None
+        return
+    # 相同的内容已经渲染过时直接使用缓存的结果, 不必再交给进程池
+    key = render_key(value, profile)
+    html = render_cache.get(key)
+    if html is None:
+        if has_app_context() and current_app.config["FLASKY_ASYNC_RENDER"]:
+            target.body_html = None
+            target._pending_render = (value, profile, current_app.config["FLASKY_RENDER_WORKERS"])
+            return
+        html = render_html(value, profile)
+        render_cache.set(key, html)
+    target._pending_render = None
+    target.body_html = html
+
+
+def queue_render(mapper, connection, target):
+    """行写入数据库后预留渲染名额并记录需要渲染的内容, 等事务提交后再提交给进程池
+    名额已满时在flush中同步渲染, 与行在同一个事务中写入"""
+    pending = target.__dict__.pop("_pending_render", None)
+    if not pending:
+        return
+    body, profile, max_workers = pending
+    if render_pool.reserve(current_app.config["FLASKY_RENDER_MAX_PENDING"]):
+        session = object_session(target)
+        session.info.setdefault("pending_renders", []).append((mapper, target.id) + pending + (page_tags(target),))
+        return
+    html = render_html_cached(body, profile)
+    table = mapper.local_table
+    connection.execute(table.update().where(table.c.id == target.id).values(body_html=html))
+    set_committed_value(target, "body_html", html)
+
+
+def submit_renders(session):
+    for mapper, id, body, profile, max_workers, tags in session.info.pop("pending_renders", []):
+        render_pool.submit(session.get_bind(mapper), mapper.local_table, id, body, profile, max_workers, tags)
+
+
+def discard_renders(session, transaction):
+    """最外层事务没有提交就结束时归还预留的名额
+    请求结束时session.remove()直接关闭会话, 不会触发after_rollback, 所以在事务结束时处理"""
+    if transaction.parent is not None:
+        return
+    pending = session.info.pop("pending_renders", ())
+    if pending:
+        render_pool.release(len(pending))
+
+
+db.event.listen(db.session, "after_commit", submit_renders)
+db.event.listen(db.session, "after_transaction_end", discard_renders)
+
+
+def rerender_rows(model, profile, chunk_size=500, start_id=0, max_workers=None):
+    """按id顺序分块重新渲染model中所有行的body_html, 用于标签白名单或markdown/bleach升级之后
+    每块在进程池中并行渲染, 只把结果有变化的行用一条批量UPDATE写回并提交
+    每完成一块yield (本块行数, 更新行数, 本块最后的id), 可以用最后的id从中断处继续"""
+    table = model.__table__
+    update = table.update().where(table.c.id == db.bindparam("row_id"))\
+                           .values(body_html=db.bindparam("html"), version=table.c.version + 1)
+    last_id = start_id
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            rows = db.session.query(model.id, model.body, model.body_html)\
+                             .filter(model.id > last_id, model.body.isnot(None))\
+                             .order_by(model.id).limit(chunk_size).all()   # 每次只取一块, 内存占用以块大小为上限
+            if not rows:
+                break
+            bodies = [row.body for row in rows]
+            htmls = pool.map(render_html, bodies, [profile] * len(bodies),
+                             chunksize=max(1, len(bodies) // (4 * (max_workers or os.cpu_count() or 1))))
+            changed = [{"row_id": row.id, "html": html} for row, html in zip(rows, htmls) if html != row.body_html]
+            if changed:
+                db.session.execute(update, changed)
+            db.session.commit()
+            if changed:
+                invalidate_pages("site")   # 整块重新渲染, 所有缓存的页面都失效
+            last_id = rows[-1].id
+            yield len(rows), len(changed), last_id
+
@@ -0,0 +1,86 @@
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadData
+
+from collections import namedtuple
+import calendar
+import threading
+import time
+
+
+class TokenIdentity(namedtuple("TokenIdentity", "id confirmed permissions generation")):
+    """从API令牌中解出的用户身份, 鉴权时不需要查询数据库"""
+    __slots__ = ()
+    is_anonymous = False
+
+    def can(self, perm):
+        return self.permissions & perm == perm
+
+
+def token_serializer(app=None):
+    """每个应用只创建一次令牌序列化器, 保存在app.extensions中"""
+    app = app or current_app._get_current_object()
+    serializer = app.extensions.get("api_token_serializer")
+    if serializer is None:
+        serializer = URLSafeTimedSerializer(app.config["SECRET_KEY"], salt="api-token")
+        app.extensions["api_token_serializer"] = serializer
+    return serializer
+
+
+def generate_token(user, expiration):
+    """生成紧凑的令牌: [用户id, 是否确认, 权限位, 令牌代数, 有效期(秒)], 签名中带有生成时间"""
+    permissions = user.role.permissions if user.role is not None else 0
+    payload = [user.id, int(bool(user.confirmed)), permissions or 0, user.token_generation or 0, expiration]
+    return token_serializer().dumps(payload)
+
+
+def verify_token(token):
+    """验证令牌的签名, 有效期和代数, 成功时返回TokenIdentity, 否则返回None"""
+    try:
+        payload, signed_at = token_serializer().loads(token, return_timestamp=True)
+        id, confirmed, permissions, generation, expiration = payload
+    except (BadData, TypeError, ValueError):
+        return None
+    if time.time() - calendar.timegm(signed_at.utctimetuple()) > expiration:
+        return None
+    if revocation_list.is_revoked(id, generation):
+        return None
+    return TokenIdentity(id, bool(confirmed), permissions, generation)
+
+
+class RevocationList:
+    """记录每个用户当前的令牌代数, 代数小于它的令牌都已作废
+    只保存代数大于0(修改过密码等)的用户, 每隔一段时间从数据库刷新一次"""
+    def __init__(self):
+        self._generations = {}
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def refresh(self, table, bind):
+        rows = bind.execute(table.select().with_only_columns([table.c.id, table.c.token_generation])
+                                          .where(table.c.token_generation > 0))
+        generations = {row.id: row.token_generation for row in rows}
+        with self._lock:
+            self._generations = generations
+            self._loaded = time.monotonic()
+
+    def revoke(self, user_id, generation):
+        """本进程中立即作废该用户代数小于generation的令牌"""
+        with self._lock:
+            if generation > self._generations.get(user_id, 0):
+                self._generations[user_id] = generation
+
+    def is_revoked(self, user_id, generation):
+        if self._loaded is None or \
+           time.monotonic() - self._loaded > current_app.config["FLASKY_TOKEN_REVOCATION_REFRESH"]:
+            from . import db
+            from .models import User
+            self.refresh(User.__table__, db.engine)
+        return generation < self._generations.get(user_id, 0)
+
+    def clear(self):
+        with self._lock:
+            self._generations = {}
+            self._loaded = None
+
+
+revocation_list = RevocationList()
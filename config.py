@@ -12,14 +12,73 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     FLASKY_MAIL_SUBJECT_PREFIX = '[Hey]'
     FLASKY_MAIL_SENDER = 'Flasky Admin <flasky@example.com>'
+    # 邮件发件箱: 发送线程数, 每次取出的数量, 空闲多久关闭SMTP连接, 轮询间隔和租约(秒)
+    FLASKY_MAIL_WORKERS = int(os.environ.get('FLASKY_MAIL_WORKERS', '2'))
+    FLASKY_MAIL_BATCH_SIZE = 20
+    FLASKY_MAIL_IDLE_TIMEOUT = 60
+    FLASKY_MAIL_POLL_INTERVAL = 5
+    FLASKY_MAIL_LEASE = 300
+    # 发送失败后按FLASKY_MAIL_RETRY_BACKOFF * 2^(n-1)秒重试, 最多FLASKY_MAIL_MAX_ATTEMPTS次
+    FLASKY_MAIL_RETRY_BACKOFF = 30
+    FLASKY_MAIL_RETRY_MAX_DELAY = 3600
+    FLASKY_MAIL_MAX_ATTEMPTS = 5
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     FLASKY_POST_PER_PAGE = 20
     FLASKY_FOLLOWERS_PER_PAGE = 10
     FLASKY_COMMENTS_PER_PAGE = 30
+    FLASKY_KEYSET_PAGINATION = os.environ.get('FLASKY_KEYSET_PAGINATION', 'false').lower() in ['true', 'on', '1']   # 列表默认使用游标分页
+    # API列表总数的默认计算方式(exact/cached/none, 请求可用?count=指定), 以及cached总数在后台重新计数的间隔(秒)
+    FLASKY_API_COUNT_MODE = os.environ.get('FLASKY_API_COUNT_MODE', 'exact')
+    FLASKY_COUNT_CACHE_TTL = int(os.environ.get('FLASKY_COUNT_CACHE_TTL', '60'))
     SQLALCHEMY_RECORD_QUERIES = True
     FLASKY_SLOW_DB_QURY_TIME = .5
+    # 用户最近访问时间的更新粒度(秒), 以及缓冲写入的间隔(秒)和数量
+    FLASKY_LAST_SEEN_GRANULARITY = int(os.environ.get('FLASKY_LAST_SEEN_GRANULARITY', '60'))
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('FLASKY_LAST_SEEN_FLUSH_INTERVAL', '30'))
+    FLASKY_LAST_SEEN_FLUSH_SIZE = int(os.environ.get('FLASKY_LAST_SEEN_FLUSH_SIZE', '100'))
+    # worker进程中缓存的用户身份数量和过期时间(秒), 其他worker中的修改最多在过期时间后生效
+    FLASKY_IDENTITY_CACHE_SIZE = 10000
+    FLASKY_IDENTITY_CACHE_TTL = int(os.environ.get('FLASKY_IDENTITY_CACHE_TTL', '60'))
+    # API中验证成功的邮箱密码组合的缓存数量和过期时间(秒)
+    FLASKY_CREDENTIAL_CACHE_SIZE = 1024
+    FLASKY_CREDENTIAL_CACHE_TTL = int(os.environ.get('FLASKY_CREDENTIAL_CACHE_TTL', '60'))
+    # API令牌作废列表从数据库刷新的间隔(秒)
+    FLASKY_TOKEN_REVOCATION_REFRESH = int(os.environ.get('FLASKY_TOKEN_REVOCATION_REFRESH', '30'))
+    # 密码hash策略, 已有的hash在下次登录成功时按新的策略重新生成; password_hash列长128, 摘要只能用sha256及以下
+    FLASKY_PASSWORD_HASH_ALGORITHM = os.environ.get('FLASKY_PASSWORD_HASH_ALGORITHM', 'sha256')
+    FLASKY_PASSWORD_HASH_ITERATIONS = int(os.environ.get('FLASKY_PASSWORD_HASH_ITERATIONS', '150000'))
+    FLASKY_PASSWORD_SALT_LENGTH = 16
+    # 共享缓存的后端(null/simple/filesystem/sqlite), 超过threshold条时淘汰, 默认过期时间(秒)
+    FLASKY_CACHE_TYPE = os.environ.get('FLASKY_CACHE_TYPE', 'sqlite')
+    # 没有配置时放在应用的instance目录中(instance/cache.sqlite, instance/cache), 不能使用其他用户可写的目录
+    FLASKY_CACHE_PATH = os.environ.get('FLASKY_CACHE_PATH')
+    FLASKY_CACHE_DIR = os.environ.get('FLASKY_CACHE_DIR')
+    # 缓存键的前缀, 没有配置时由数据库地址生成, 同一台机器上的不同部署互不影响
+    FLASKY_CACHE_KEY_PREFIX = os.environ.get('FLASKY_CACHE_KEY_PREFIX')
+    FLASKY_CACHE_THRESHOLD = int(os.environ.get('FLASKY_CACHE_THRESHOLD', '1000'))
+    FLASKY_CACHE_DEFAULT_TIMEOUT = 300
+    # API一次最多查询的id数量, 以及include=comments时每篇文章包含的最新评论数
+    FLASKY_API_MULTIGET_MAX = 100
+    FLASKY_API_INCLUDED_COMMENTS = 5
+    # 批量新建文章和评论时一次最多的条数
+    FLASKY_API_BATCH_MAX = int(os.environ.get('FLASKY_API_BATCH_MAX', '100'))
+    # 匿名访客的整页缓存, 以及缓存的时间(秒), 同时作为响应的Cache-Control: max-age
+    FLASKY_PAGE_CACHE = os.environ.get('FLASKY_PAGE_CACHE', 'true').lower() in ['true', 'on', '1']
+    FLASKY_PAGE_CACHE_TIMEOUT = int(os.environ.get('FLASKY_PAGE_CACHE_TIMEOUT', '30'))
+    # gzip压缩响应, 压缩级别(1-9), 小于min_size字节的响应不压缩
+    FLASKY_COMPRESSION = os.environ.get('FLASKY_COMPRESSION', 'true').lower() in ['true', 'on', '1']
+    FLASKY_COMPRESSION_LEVEL = int(os.environ.get('FLASKY_COMPRESSION_LEVEL', '6'))
+    FLASKY_COMPRESSION_MIN_SIZE = 500
+    # 只压缩动态生成的html和json; 静态文件每次都要整体读入再压缩, 应交给前端服务器预压缩
+    FLASKY_COMPRESSION_MIMETYPES = ['text/html', 'application/json']
     SSL_REDIRECT = False
+    # 在进程池中渲染文章和评论的markdown, 请求中只保存原文
+    FLASKY_ASYNC_RENDER = os.environ.get('FLASKY_ASYNC_RENDER', 'false').lower() in ['true', 'on', '1']
+    FLASKY_RENDER_WORKERS = int(os.environ.get('FLASKY_RENDER_WORKERS', '2'))
+    FLASKY_RENDER_MAX_PENDING = 64   # 超过时退回到请求中同步渲染
+    FLASKY_RENDER_CACHE_SIZE = int(os.environ.get('FLASKY_RENDER_CACHE_SIZE', '4096'))   # 渲染结果缓存的条数
+    FLASKY_FRAGMENT_CACHE_SIZE = int(os.environ.get('FLASKY_FRAGMENT_CACHE_SIZE', '4096'))   # 模板片段缓存的条数
 
     @staticmethod
     def init_app(app):
@@ -39,6 +98,10 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite://'
     WTF_CSRF_ENABLED = False   # 禁用CSRF保护机制
+    FLASKY_LAST_SEEN_FLUSH_SIZE = 1   # 最近访问时间立即写入, 不在测试之间残留
+    FLASKY_PASSWORD_HASH_ITERATIONS = 1000   # 测试中不需要抵抗暴力破解
+    FLASKY_MAIL_WORKERS = 0   # 邮件留在发件箱中, 由测试调用outbox.drain()发送
+    FLASKY_CACHE_TYPE = 'simple'
 
 
 class ProductionConfig(Config):
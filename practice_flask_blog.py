@@ -7,12 +7,15 @@ if os.environ.get("FLASK_COVERAGE"):
     COV.start()
 
 
+import json
 import sys
+import time
 
 import click
 from flask_migrate import Migrate, upgrade
 from app import create_app, db
-from app.models import User, Follow, Role, Permission, Post, Comment
+from app.models import User, Follow, Role, Permission, Post, Comment, Timeline, reconcile_counters
+from app.render import rerender_rows
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 migrate = Migrate(app, db)
@@ -20,7 +23,8 @@ migrate = Migrate(app, db)
 
 @app.shell_context_processor
 def make_shell_context():
-    return dict(db=db, User=User, Follow=Follow, Role=Role, Permission=Permission, Post=Post, Comment=Comment)
+    return dict(db=db, User=User, Follow=Follow, Role=Role, Permission=Permission, Post=Post, Comment=Comment,
+                Timeline=Timeline)
 
 
 # @app.cli.command()
@@ -75,3 +79,186 @@ def deploy():
 
     # 确保所有用户都关注了他们自己
     User.add_self_follows()
+
+
+@app.cli.command("rebuild-timeline")
+@click.option("--username", default=None, help="Only rebuild the timeline of this user.")
+def rebuild_timeline(username):
+    """依据关注关系重新生成物化的首页时间线"""
+    user = None
+    if username is not None:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.BadParameter("no such user: %s" % username)
+    Timeline.rebuild(user)
+    click.echo("Timeline rebuilt.")
+
+
+@app.cli.command("reconcile-counters")
+def reconcile_counters_command():
+    """用实际行数修复文章、评论、关注的计数缓存"""
+    for column, repaired in sorted(reconcile_counters().items()):
+        click.echo("%s: %d rows repaired" % (column, repaired))
+
+
+@app.cli.command("backfill-avatars")
+@click.option("--chunk-size", default=500, help="Number of users updated per transaction.")
+def backfill_avatars(chunk_size):
+    """为还没有头像hash缓存的用户批量生成hash"""
+    click.echo("%d users updated." % User.backfill_avatar_hashes(chunk_size))
+
+
+@app.cli.command()
+@click.option("--only", type=click.Choice(["posts", "comments"]), default=None, help="Only re-render this table.")
+@click.option("--chunk-size", default=500, help="Number of rows rendered and written per transaction.")
+@click.option("--workers", default=None, type=int, help="Number of render processes, defaults to the CPU count.")
+@click.option("--checkpoint", default=None, help="File recording the last rendered id of each table, used to resume.")
+def rerender(only, chunk_size, workers, checkpoint):
+    """用当前的markdown/bleach配置重新生成所有文章和评论的body_html"""
+    progress = {}
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            progress = json.load(f)
+    for name, model, profile in (("posts", Post, "post"), ("comments", Comment, "comment")):
+        if only is not None and only != name:
+            continue
+        start_id = progress.get(name, 0)
+        if start_id:
+            click.echo("%s: resuming after id %d" % (name, start_id))
+        total = updated = 0
+        started = time.time()
+        for rows, changed, last_id in rerender_rows(model, profile, chunk_size, start_id, workers):
+            total += rows
+            updated += changed
+            if checkpoint:
+                progress[name] = last_id
+                with open(checkpoint, "w") as f:
+                    json.dump(progress, f)
+            elapsed = time.time() - started
+            click.echo("%s: %d rows rendered, %d updated, last id %d, %.1f rows/s"
+                       % (name, total, updated, last_id, total / elapsed if elapsed else 0))
+        click.echo("%s: done, %d rows rendered, %d updated in %.1fs" % (name, total, updated, time.time() - started))
+
+
+@app.cli.command("bench-password")
+@click.option("--rounds", default=20, help="Number of verifications measured per policy.")
+@click.option("--iterations", default="50000,100000,150000,300000",
+              help="Comma separated PBKDF2 iteration counts to compare with the configured policy.")
+def bench_password(rounds, iterations):
+    """比较不同密码hash策略下一次登录验证的耗时"""
+    from werkzeug.security import generate_password_hash, check_password_hash
+    from app.models import password_hash_method
+    methods = [password_hash_method()]
+    for count in iterations.split(","):
+        method = "pbkdf2:%s:%d" % (app.config["FLASKY_PASSWORD_HASH_ALGORITHM"], int(count))
+        if method not in methods:
+            methods.append(method)
+    for method in methods:
+        password_hash = generate_password_hash("benchmark password", method=method)
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            check_password_hash(password_hash, "benchmark password")
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * .95))]
+        click.echo("%-24s mean %7.1fms  p95 %7.1fms%s" % (method, sum(timings) / len(timings) * 1000, p95 * 1000,
+                                                          "  (configured)" if method == methods[0] else ""))
+
+
+@app.cli.command("mail-outbox")
+@click.option("--drain/--no-drain", default=False, help="Send all due messages before reporting.")
+def mail_outbox(drain):
+    """查看发件箱中等待发送和已经放弃的邮件数量"""
+    from app.email import outbox
+    if drain:
+        click.echo("%d messages processed." % outbox.drain())
+    depth = outbox.depth()
+    click.echo("pending: %d, failed: %d" % (depth["pending"], depth["failed"]))
+
+
+@app.cli.command("bench-serialize")
+@click.option("--items", default=1000, help="Number of posts on the benchmarked page.")
+@click.option("--rounds", default=20, help="Number of times each serializer runs.")
+def bench_serialize(items, rounds):
+    """比较逐个对象调用url_for加jsonify与按列序列化的API输出速度"""
+    import datetime
+    from collections import namedtuple
+    from flask import jsonify, url_for
+    from app.api.serializers import POST_COLUMNS, post_json, serialize_many, json_response, json_library
+    Row = namedtuple("Row", [column.key for column in POST_COLUMNS])
+    now = datetime.datetime.utcnow()
+    rows = [Row(id=id, timestamp=now, author_id=id % 50 + 1, body="body %d" % id, body_html="<p>body %d</p>" % id,
+                comment_count=id % 7, version=1) for id in range(1, items + 1)]
+
+    def legacy():
+        return jsonify({"posts": [{
+            "url": url_for("api.get_post", id=row.id),
+            "body": row.body,
+            "body_html": row.body_html,
+            "timestamp": row.timestamp,
+            "author_url": url_for("api.get_user", id=row.author_id),
+            "comments_url": url_for("api.get_post_comments", id=row.id),
+            "comment_count": row.comment_count,
+        } for row in rows]})
+
+    def columns():
+        return json_response({"posts": serialize_many(post_json, rows)})
+
+    click.echo("json library: %s" % json_library)
+    with app.test_request_context():
+        for name, serialize in (("url_for + jsonify", legacy), ("column serializer", columns)):
+            serialize()
+            started = time.perf_counter()
+            for _ in range(rounds):
+                serialize()
+            elapsed = (time.perf_counter() - started) / rounds
+            click.echo("%-20s %7.2fms/page  %9.0f items/s" % (name, elapsed * 1000, items / elapsed))
+
+
+@app.cli.command()
+@click.argument("table", type=click.Choice(["posts", "comments"]))
+@click.option("--since", default=None, help="Only export rows created at or after this UTC timestamp.")
+@click.option("--until", default=None, help="Only export rows created before this UTC timestamp.")
+@click.option("--output", type=click.File("wb"), default="-", help="File to write, defaults to stdout.")
+@click.option("--batch-size", default=1000, help="Number of rows fetched from the cursor at a time.")
+def export(table, since, until, output, batch_size):
+    """把文章或评论以NDJSON格式导出, 每行一个json对象"""
+    from app.api.export import EXPORTS, parse_timestamp, export_lines
+    from app.exceptions import ValidationError
+    model, resource = EXPORTS[table]
+    try:
+        since, until = parse_timestamp(since, "since"), parse_timestamp(until, "until")
+    except ValidationError as e:
+        raise click.BadParameter(e.args[0])
+    count = 0
+    with app.test_request_context():   # 生成资源链接需要请求上下文
+        for line in export_lines(model, resource.serializer(resource.default), resource.columns(resource.default),
+                                 since, until, batch_size):
+            output.write(line)
+            count += 1
+    click.echo("%d %s exported." % (count, table), err=True)
+
+
+@app.cli.command("bench-compression")
+@click.option("--levels", default="1,6,9", help="Comma separated gzip levels to compare.")
+@click.option("--rounds", default=50, help="Number of times each payload is compressed.")
+def bench_compression(levels, rounds):
+    """用当前数据库中的首页和api.get_posts输出比较不同gzip级别的压缩率和CPU耗时"""
+    import gzip
+    from app.api.serializers import POST_COLUMNS, post_json, serialize_many, json_response
+    with app.test_request_context():
+        rows = db.session.query(*POST_COLUMNS).order_by(Post.timestamp.desc())\
+                         .limit(app.config["FLASKY_POST_PER_PAGE"]).all()
+        api_payload = json_response({"posts": serialize_many(post_json, rows)}).get_data()
+    index_payload = app.test_client().get("/").get_data()   # 不带Accept-Encoding, 得到未压缩的页面
+    for name, payload in (("index", index_payload), ("api.get_posts", api_payload)):
+        click.echo("%s: %d bytes" % (name, len(payload)))
+        for level in [int(level) for level in levels.split(",")]:
+            started = time.perf_counter()
+            for _ in range(rounds):
+                compressed = gzip.compress(payload, level)
+            elapsed = (time.perf_counter() - started) / rounds
+            click.echo("  level %d: %7d bytes (%5.1f%%), %.3fms per response, %.1f MB/s"
+                       % (level, len(compressed), len(compressed) * 100.0 / len(payload), elapsed * 1000,
+                          len(payload) / elapsed / 1e6))
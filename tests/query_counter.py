@@ -0,0 +1,37 @@
+import contextlib
+
+from sqlalchemy import event
+
+from app import db
+
+
+class QueryCounter:
+    """统计代码块中向数据库发出的SQL语句"""
+    def __init__(self, engine=None):
+        self.engine = engine or db.engine
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class QueryBudgetMixin:
+    """给unittest.TestCase使用, 超出查询预算时测试失败并列出所有语句"""
+    @contextlib.contextmanager
+    def assertQueryBudget(self, budget, msg=None):
+        with QueryCounter() as counter:
+            yield counter
+        if counter.count > budget:
+            self.fail("%s%d queries issued, budget is %d:\n%s" % (
+                msg + ": " if msg else "", counter.count, budget, "\n".join(counter.statements)))
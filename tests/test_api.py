@@ -1,9 +1,11 @@
 import unittest
+import datetime
 import json
 import re
 from base64 import b64encode
 from app import create_app, db
 from app.models import User, Role, Post, Comment
+from .query_counter import QueryCounter
 
 
 class APITestCase(unittest.TestCase):
@@ -262,3 +264,285 @@ class APITestCase(unittest.TestCase):
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get('comments'))
         self.assertEqual(json_response.get('count', 0), 2)
+
+    def test_credential_cache(self):
+        from app.cache import credential_cache
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        for _ in range(3):
+            response = self.client.get('/api/ver1/posts/', headers=headers)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(credential_cache.verifications, 1)
+        # 其他worker修改了密码: 本进程的缓存项没有被删除, 但令牌代数已经改变
+        from app.tokens import revocation_list
+        db.engine.execute(User.__table__.update().values(token_generation=User.__table__.c.token_generation + 1))
+        revocation_list.clear()
+        response = self.client.get('/api/ver1/posts/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(credential_cache.verifications, 2)
+        # 修改邮箱后旧邮箱不能再通过缓存验证
+        u = User.query.get(u.id)
+        u.email = 'johnny@example.com'
+        db.session.commit()
+        response = self.client.get('/api/ver1/posts/', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        # 修改密码后旧密码不能再通过缓存验证
+        headers = self.get_api_headers('johnny@example.com', 'cat')
+        self.client.get('/api/ver1/posts/', headers=headers)
+        u.password = 'dog'
+        db.session.commit()
+        response = self.client.get('/api/ver1/posts/', headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_token_revocation(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        response = self.client.post('/api/ver1/tokens/', headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 200)
+        token = json.loads(response.get_data(as_text=True))['token']
+        response = self.client.get('/api/ver1/posts/', headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 200)
+        # 令牌不能用来获取新的令牌
+        response = self.client.post('/api/ver1/tokens/', headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 401)
+        # 修改密码后之前的令牌作废
+        u.password = 'dog'
+        db.session.commit()
+        response = self.client.get('/api/ver1/posts/', headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 401)
+
+    def test_conditional_get(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True, role=r)
+        post = Post(body='body of the post', author=u)
+        db.session.add_all([u, post])
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        response = self.client.get('/api/ver1/posts/%d' % post.id, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        headers['If-None-Match'] = etag
+        response = self.client.get('/api/ver1/posts/%d' % post.id, headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        # 新评论改变了评论数, 版本号随之增加
+        db.session.add(Comment(body='a comment', post=post, author=u))
+        db.session.commit()
+        response = self.client.get('/api/ver1/posts/%d' % post.id, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        etag = response.headers['ETag']
+        post.body = 'updated body'
+        db.session.commit()
+        headers['If-None-Match'] = etag
+        response = self.client.get('/api/ver1/posts/%d' % post.id, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['posts']['body'], 'updated body')
+        # 列表使用内容的hash
+        response = self.client.get('/api/ver1/posts/', headers=headers)
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.get('/api/ver1/posts/', headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+    def test_multiget_include(self):
+        r = Role.query.filter_by(name='User').first()
+        u1 = User(email='john@example.com', username='john', password='cat', confirmed=True, role=r)
+        u2 = User(email='susan@example.com', username='susan', password='dog', confirmed=True, role=r)
+        p1 = Post(body='post by john', author=u1)
+        p2 = Post(body='post by susan', author=u2)
+        db.session.add_all([u1, u2, p1, p2])
+        db.session.commit()
+        for i in range(7):
+            db.session.add(Comment(body='comment %d' % i, post=p1, author=u2))
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        response = self.client.get('/api/ver1/posts/?ids=%d,%d,999&include=author,comments' % (p2.id, p1.id),
+                                   headers=headers)
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual([post['body'] for post in json_response['posts']], ['post by susan', 'post by john'])
+        self.assertEqual(sorted(user['username'] for user in json_response['included']['users']), ['john', 'susan'])
+        self.assertEqual([comment['body'] for comment in json_response['included']['comments']],
+                         ['comment %d' % i for i in range(2, 7)])
+        # 没有窗口函数的旧SQLite使用关联子查询, 结果相同
+        from app.api import compound
+        supports_window_functions = compound.supports_window_functions
+        compound.supports_window_functions = lambda bind: False
+        try:
+            fallback = compound.latest_comments([p1.id, p2.id], 5)
+        finally:
+            compound.supports_window_functions = supports_window_functions
+        self.assertEqual(fallback, compound.latest_comments([p1.id, p2.id], 5))
+        response = self.client.get('/api/ver1/users/?ids=%d,%d' % (u2.id, u1.id), headers=headers)
+        self.assertEqual([user['username'] for user in json.loads(response.get_data(as_text=True))['users']],
+                         ['susan', 'john'])
+        response = self.client.get('/api/ver1/posts/?include=likes', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/ver1/posts/?ids=1,x', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_serialized_post(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True, role=r)
+        post = Post(body='body of the *post*', author=u)
+        db.session.add_all([u, post])
+        db.session.commit()
+        db.session.add(Comment(body='a comment', post=post, author=u))
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        response = self.client.get('/api/ver1/posts/%d' % post.id, headers=headers)
+        json_post = json.loads(response.get_data(as_text=True))['posts']
+        self.assertEqual(json_post['url'], '/api/ver1/posts/%d' % post.id)
+        self.assertEqual(json_post['author_url'], '/api/ver1/users/%d' % u.id)
+        self.assertEqual(json_post['body_html'], '<p>body of the <em>post</em></p>')
+        self.assertEqual(json_post['comment_count'], 1)
+        # 与flask的json编码器格式相同
+        self.assertEqual(json_post['timestamp'], json.loads(self.app.json_encoder().encode(post.timestamp)))
+        response = self.client.get(json_post['comments_url'], headers=headers)
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual([comment['body'] for comment in json_response['comments']], ['a comment'])
+
+    def test_sparse_fieldsets(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True, role=r)
+        post = Post(body='body of the post', author=u)
+        db.session.add_all([u, post])
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        with QueryCounter() as counter:
+            response = self.client.get('/api/ver1/posts/?fields=id,timestamp,body_html', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        json_post = json.loads(response.get_data(as_text=True))['posts'][0]
+        self.assertEqual(sorted(json_post), ['body_html', 'id', 'timestamp'])
+        self.assertEqual(json_post['id'], post.id)
+        # 没有请求的列不会出现在SELECT中
+        select = [statement for statement in counter.statements if 'FROM posts' in statement][0]
+        self.assertNotIn('posts.body,', select)
+        self.assertNotIn('comment_count', select)
+        response = self.client.get('/api/ver1/posts/?fields=id,password', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        # 翻页链接保留fields和count, 之后的页面同样只返回请求的字段
+        db.session.add_all([Post(body='post %d' % i, author=u) for i in range(25)])
+        db.session.commit()
+        for query in ('?fields=id&count=none', '?fields=id&after='):
+            response = self.client.get('/api/ver1/posts/' + query, headers=headers)
+            next_url = json.loads(response.get_data(as_text=True))['next_url']
+            self.assertIn('fields=id', next_url)
+            json_response = json.loads(self.client.get(next_url, headers=headers).get_data(as_text=True))
+            self.assertEqual([sorted(p) for p in json_response['posts']], [['id']] * 6)
+            self.assertIn('fields=id', json_response['prev_url'])
+        response = self.client.get('/api/ver1/posts/?fields=id&count=none', headers=headers)
+        self.assertIn('count=none', json.loads(response.get_data(as_text=True))['next_url'])
+
+    def test_export(self):
+        admin_role = Role.query.filter_by(name='Administrator').first()
+        user_role = Role.query.filter_by(name='User').first()
+        admin = User(email='admin@example.com', password='cat', confirmed=True, role=admin_role)
+        u = User(email='john@example.com', password='dog', confirmed=True, role=user_role)
+        db.session.add_all([admin, u])
+        for day in range(1, 4):
+            db.session.add(Post(body='post %d' % day, author=u, timestamp=datetime.datetime(2020, 1, day)))
+        db.session.commit()
+        response = self.client.get('/api/ver1/export/posts', headers=self.get_api_headers('john@example.com', 'dog'))
+        self.assertEqual(response.status_code, 403)
+        headers = self.get_api_headers('admin@example.com', 'cat')
+        response = self.client.get('/api/ver1/export/posts?since=2020-01-02&fields=body', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{'body': 'post 2'}, {'body': 'post 3'}])
+        response = self.client.get('/api/ver1/export/posts?until=2020-01-02', headers=headers)
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 1)
+        response = self.client.get('/api/ver1/export/posts?since=yesterday', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_count_modes(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        for i in range(self.app.config['FLASKY_POST_PER_PAGE'] + 5):
+            db.session.add(Post(body='post %d' % i, author=u))
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        # none: 多取一行判断下一页, 不执行COUNT
+        with QueryCounter() as counter:
+            response = self.client.get('/api/ver1/posts/?count=none', headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertIsNone(json_response['count'])
+        self.assertIsNotNone(json_response['next_url'])
+        self.assertEqual(len(json_response['posts']), self.app.config['FLASKY_POST_PER_PAGE'])
+        self.assertFalse([statement for statement in counter.statements if 'count(' in statement.lower()])
+        # 多取的一行不存在, 是最后一页
+        response = self.client.get('/api/ver1/posts/?count=none&page=2', headers=headers)
+        self.assertIsNone(json.loads(response.get_data(as_text=True))['next_url'])
+        # 最后一页由行数直接得到总数, 不执行COUNT
+        with QueryCounter() as counter:
+            response = self.client.get('/api/ver1/posts/?count=exact&page=2', headers=headers)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['count'], 25)
+        self.assertFalse([statement for statement in counter.statements if 'count(' in statement.lower()])
+        # cached: 第一次计数后使用缓存的总数
+        response = self.client.get('/api/ver1/posts/?count=cached', headers=headers)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['count'], 25)
+        db.session.add(Post(body='one more', author=u))
+        db.session.commit()
+        response = self.client.get('/api/ver1/posts/?count=cached', headers=headers)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['count'], 25)
+        response = self.client.get('/api/ver1/posts/', headers=headers)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['count'], 26)
+        response = self.client.get('/api/ver1/posts/?count=maybe', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_create(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        response = self.client.post('/api/ver1/posts/batch', headers=headers,
+                                    data=json.dumps([{'body': 'first'}, {'body': 'second *post*'}]))
+        self.assertEqual(response.status_code, 201)
+        json_posts = json.loads(response.get_data(as_text=True))['posts']
+        self.assertEqual([post['body'] for post in json_posts], ['first', 'second *post*'])
+        self.assertEqual(json_posts[1]['body_html'], '<p>second <em>post</em></p>')
+        # 任何一项不合法时整批都不写入, 并报告每一项的错误
+        response = self.client.post('/api/ver1/posts/batch', headers=headers,
+                                    data=json.dumps([{'body': 'ok'}, {'body': ''}, 'text']))
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.get_data(as_text=True))['errors']
+        self.assertEqual([error['index'] for error in errors], [1, 2])
+        self.assertEqual(Post.query.count(), 2)
+        post_id = Post.query.first().id
+        response = self.client.post('/api/ver1/comments/batch', headers=headers,
+                                    data=json.dumps([{'post_id': post_id, 'body': 'good'}, {'post_id': 999, 'body': 'x'}]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['errors'][0]['index'], 1)
+        response = self.client.post('/api/ver1/comments/batch', headers=headers,
+                                    data=json.dumps([{'post_id': post_id, 'body': 'good'}, {'post_id': post_id, 'body': 'too'}]))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.query.get(post_id).comment_count, 2)
+        self.app.config['FLASKY_API_BATCH_MAX'] = 1
+        response = self.client.post('/api/ver1/posts/batch', headers=headers,
+                                    data=json.dumps([{'body': 'a'}, {'body': 'b'}]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_token_user_loaded_once(self):
+        from flask import g
+        from app.api.authentication import verify_password
+        from app.models import identity_cache
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_auth_token(3600)
+        with self.app.test_request_context():
+            self.assertTrue(verify_password(token, ''))
+            lookups = identity_cache.hits + identity_cache.misses
+            for _ in range(3):
+                self.assertEqual(g.current_user.username, 'john')
+            self.assertEqual(identity_cache.hits + identity_cache.misses - lookups, 1)
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from flask import Flask
+from app.cache import SharedCache, SqliteCache
+
+
+class SqliteCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_shared_between_instances(self):
+        # 两个实例相当于两个worker进程
+        a = SqliteCache(self.path)
+        b = SqliteCache(self.path)
+        a.set('new_email_1', 'john@example.com', timeout=60)
+        self.assertEqual(b.get('new_email_1'), 'john@example.com')
+        self.assertFalse(b.add('new_email_1', 'other@example.com'))
+        self.assertTrue(b.delete('new_email_1'))
+        self.assertIsNone(a.get('new_email_1'))
+
+    def test_timeout_and_threshold(self):
+        cache = SqliteCache(self.path, threshold=3)
+        cache.set('expired', 1, timeout=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('expired'))
+        self.assertTrue(cache.add('expired', 2))
+        for i in range(5):
+            cache.set('key%d' % i, i, timeout=60 + i)
+        self.assertEqual(cache._connection().execute('SELECT count(*) FROM cache').fetchone()[0], 3)
+        # 先淘汰最早到期的项
+        self.assertIsNone(cache.get('key0'))
+        self.assertEqual(cache.get('key4'), 4)
+
+    def test_prune_keeps_new_key(self):
+        # 永不过期的项已经超过threshold时, 刚写入的项也不能被删除
+        cache = SqliteCache(self.path, threshold=3)
+        cache.set('pending', 1, timeout=3600)
+        for i in range(3):
+            cache.set('forever%d' % i, i, timeout=0)
+        cache.set('page', 'body', timeout=30)
+        self.assertEqual(cache.get('page'), 'body')
+        self.assertEqual(cache._connection().execute('SELECT count(*) FROM cache').fetchone()[0], 3)
+
+    def make_app(self, database):
+        app = Flask(__name__, instance_path=os.path.join(self.dir, 'instance'))
+        app.config.update(FLASKY_CACHE_TYPE='sqlite', FLASKY_CACHE_PATH=None, FLASKY_CACHE_KEY_PREFIX=None,
+                          FLASKY_CACHE_THRESHOLD=100, FLASKY_CACHE_DEFAULT_TIMEOUT=60,
+                          SQLALCHEMY_DATABASE_URI=database)
+        return app
+
+    def test_default_path_and_prefix(self):
+        # 默认放在instance目录中, 不同数据库的部署共用缓存文件时键也不冲突
+        dev = SharedCache(self.make_app('sqlite:///dev.sqlite'))
+        prod = SharedCache(self.make_app('sqlite:///prod.sqlite'))
+        self.assertEqual(dev.backend.path, os.path.join(self.dir, 'instance', 'cache.sqlite'))
+        dev.set('new_email_1', 'dev@example.com')
+        self.assertIsNone(prod.get('new_email_1'))
+        prod.set('new_email_1', 'prod@example.com')
+        self.assertEqual(dev.get('new_email_1'), 'dev@example.com')
@@ -0,0 +1,57 @@
+import gzip
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role, Post
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_gzip_html(self):
+        plain = self.client.get('/')
+        self.assertIsNone(plain.headers.get('Content-Encoding'))
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.get_data()), plain.get_data())
+        stats = self.app.extensions['compression'].stats()
+        self.assertEqual(stats['responses'], 1)
+        self.assertGreater(stats['bytes_saved'], 0)
+        # 不接受gzip时不压缩
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+
+    def test_weak_etag_round_trip(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        for i in range(20):
+            db.session.add(Post(body='post number %d' % i, author=u))
+        db.session.commit()
+        headers = {
+            'Authorization': 'Basic ' + b64encode(b'john@example.com:cat').decode('utf-8'),
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip',
+        }
+        response = self.client.get('/api/ver1/posts/', headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(response.headers['ETag'].startswith('W/'))
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.get('/api/ver1/posts/', headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+    def test_static_not_compressed(self):
+        response = self.client.get('/static/styles.css', headers={'Accept-Encoding': 'gzip'})
+        self.assertIsNone(response.headers.get('Content-Encoding'))
@@ -0,0 +1,120 @@
+import asyncore
+import datetime
+import os
+import smtpd
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from app import create_app, db
+from app import mail
+from app.email import send_email, outbox
+from app.models import OutboxMessage
+
+
+class DebuggingServer(smtpd.SMTPServer):
+    """本地的SMTP替身, 记录收到的连接数和邮件"""
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None, decode_data=True)
+        self.connections = 0
+        self.messages = []
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accepted(self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append((rcpttos, data))
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def use_smtp(self, port):
+        state = self.app.extensions['mail']
+        state.server, state.port, state.use_tls, state.use_ssl, state.suppress = '127.0.0.1', port, False, False, False
+        state.username = state.password = None
+
+    def test_outbox_reuses_connection(self):
+        server = DebuggingServer()
+        thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05}, daemon=True)
+        thread.start()
+        try:
+            self.use_smtp(server.socket.getsockname()[1])
+            with self.app.test_request_context():
+                for i in range(3):
+                    send_email('user%d@example.com' % i, 'Confirm', 'auth/email/confirm_new_user',
+                               new_user=None, token='token')
+            self.assertEqual(outbox.depth(), {'pending': 3, 'failed': 0})
+            self.assertEqual(outbox.drain(), 3)
+            self.assertEqual(outbox.depth(), {'pending': 0, 'failed': 0})
+            self.assertEqual(len(server.messages), 3)
+            self.assertEqual(server.connections, 1)
+        finally:
+            server.close()
+            thread.join(1)
+
+    def test_outbox_reconnects_dropped_connection(self):
+        server = DebuggingServer()
+        thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05}, daemon=True)
+        thread.start()
+        try:
+            self.use_smtp(server.socket.getsockname()[1])
+            with self.app.test_request_context():
+                send_email('john@example.com', 'Confirm', 'auth/email/confirm_new_user', new_user=None, token='token')
+            # 模拟服务器在空闲时断开了连接
+            connection = mail.connect().__enter__()
+            connection.host.close()
+            processed, connection = outbox._deliver_batch(connection)
+            outbox._close(connection)
+            self.assertEqual(processed, 1)
+            self.assertEqual(outbox.depth(), {'pending': 0, 'failed': 0})
+            self.assertEqual(len(server.messages), 1)
+        finally:
+            server.close()
+            thread.join(1)
+
+    def test_outbox_retry(self):
+        # 找一个没有监听的端口
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.use_smtp(port)
+        with self.app.test_request_context():
+            send_email('john@example.com', 'Confirm', 'auth/email/confirm_new_user', new_user=None, token='token')
+        self.assertEqual(outbox.drain(), 1)
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.attempts, 1)
+        self.assertFalse(message.failed)
+        # 退避时间内不会再次发送
+        self.assertEqual(outbox.drain(), 0)
+
+    def test_outbox_starts_with_app(self):
+        # 发送线程使用自己的连接, 内存数据库不能共享, 用临时文件中的数据库
+        app = create_app('testing')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'outbox.sqlite')
+        app.config['FLASKY_MAIL_WORKERS'] = 1
+        with app.app_context():
+            db.create_all()
+            # 重启前留下的邮件, 之后没有新邮件
+            db.session.add(OutboxMessage(sender='a@example.com', recipient='b@example.com', subject='left over',
+                                         body='body', html='html', timestamp=datetime.datetime.utcnow(), attempts=0,
+                                         next_attempt_at=datetime.datetime.utcnow(), failed=False))
+            db.session.commit()
+            app.test_client().get('/auth/login')
+            deadline = time.monotonic() + 5
+            while outbox.depth()['pending'] and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(outbox.depth(), {'pending': 0, 'failed': 0})
+            db.session.remove()
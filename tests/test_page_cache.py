@@ -0,0 +1,86 @@
+import time
+import unittest
+from app import cache, create_app, db
+from app.models import User, Role, Post, Comment, reconcile_counters
+from app.page_cache import GENERATION_KEY, invalidate_pages
+
+
+class PageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+        self.user = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        self.post = Post(body='first post', author=self.user)
+        db.session.add_all([self.user, self.post])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_anonymous_hit(self):
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Page-Cache'], 'miss')
+        self.assertIn('public', response.headers['Cache-Control'])
+        self.assertIn('Cookie', response.headers['Vary'])
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Page-Cache'], 'hit')
+        self.assertIn('first post', response.get_data(as_text=True))
+        # 查询字符串不同是不同的页面
+        response = self.client.get('/?page=2')
+        self.assertEqual(response.headers['X-Page-Cache'], 'miss')
+
+    def test_invalidation(self):
+        url = '/post/%d' % self.post.id
+        self.client.get(url)
+        self.client.get('/user/john')
+        self.assertEqual(self.client.get(url).headers['X-Page-Cache'], 'hit')
+        db.session.add(Comment(body='nice', post=self.post, author=self.user))
+        db.session.commit()
+        response = self.client.get(url)
+        self.assertEqual(response.headers['X-Page-Cache'], 'miss')
+        self.assertIn('nice', response.get_data(as_text=True))
+        self.client.get('/user/john')
+        db.session.add(Post(body='second post', author=self.user))
+        db.session.commit()
+        self.assertIn('second post', self.client.get('/user/john').get_data(as_text=True))
+        # 新文章不影响其他文章的页面
+        self.assertEqual(self.client.get(url).headers['X-Page-Cache'], 'hit')
+
+    def test_session_bypass(self):
+        self.client.get('/')
+        self.client.set_cookie('localhost', 'session', 'x')
+        response = self.client.get('/')
+        self.assertNotIn('X-Page-Cache', response.headers)
+
+    def test_follow_invalidation(self):
+        susan = User(email='susan@example.com', username='susan', password='dog', confirmed=True)
+        db.session.add(susan)
+        db.session.commit()
+        url = '/post/%d' % self.post.id
+        self.client.get('/user/john')
+        self.client.get(url)
+        susan.follow(self.user)
+        db.session.commit()
+        # 关注数通过UPDATE直接修改, 资料页仍然要失效; 文章页不显示关注数
+        self.assertEqual(self.client.get('/user/john').headers['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(url).headers['X-Page-Cache'], 'hit')
+
+    def test_reconcile_invalidation(self):
+        self.client.get('/')
+        db.engine.execute(Post.__table__.update().values(comment_count=5))
+        reconcile_counters()
+        self.assertEqual(self.client.get('/').headers['X-Page-Cache'], 'miss')
+
+    def test_generation_expires(self):
+        # 代号不能永久保存, 否则每篇改过的文章都在共享缓存中留下一项
+        self.app.config['FLASKY_PAGE_CACHE_TIMEOUT'] = 1
+        invalidate_pages('post:%d' % self.post.id)
+        self.assertIsNotNone(cache.get(GENERATION_KEY % ('post:%d' % self.post.id)))
+        time.sleep(1.1)
+        self.assertIsNone(cache.get(GENERATION_KEY % ('post:%d' % self.post.id)))
@@ -0,0 +1,78 @@
+import unittest
+import datetime
+from app import create_app, db
+from app.exceptions import ValidationError
+from app.models import User, Post
+from app.pagination import paginate_keyset, encode_cursor, decode_cursor
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_cursor_round_trip(self):
+        now = datetime.datetime(2019, 2, 17, 15, 0, 45, 9608)
+        self.assertEqual(decode_cursor(encode_cursor(now, 42)), (now, 42))
+        with self.assertRaises(ValidationError):
+            decode_cursor('not a cursor')
+
+    def test_walk_pages(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        # 相同时间的文章依靠id排序
+        now = datetime.datetime.utcnow()
+        posts = [Post(body='post %d' % i, author=u, timestamp=now - datetime.timedelta(minutes=i // 2))
+                 for i in range(7)]
+        db.session.add_all([u] + posts)
+        db.session.commit()
+        expected = Post.query.order_by(Post.timestamp.desc(), Post.id.desc()).all()
+        columns = (Post.timestamp, Post.id)
+
+        first = paginate_keyset(Post.query, columns, 3)
+        self.assertEqual(first.items, expected[0:3])
+        self.assertFalse(first.has_prev)
+        self.assertTrue(first.has_next)
+        second = paginate_keyset(Post.query, columns, 3, after=first.next_cursor)
+        self.assertEqual(second.items, expected[3:6])
+        self.assertTrue(second.has_prev)
+        third = paginate_keyset(Post.query, columns, 3, after=second.next_cursor)
+        self.assertEqual(third.items, expected[6:])
+        self.assertFalse(third.has_next)
+        back = paginate_keyset(Post.query, columns, 3, before=third.prev_cursor)
+        self.assertEqual(back.items, expected[3:6])
+        back = paginate_keyset(Post.query, columns, 3, before=back.prev_cursor)
+        self.assertEqual(back.items, expected[0:3])
+        self.assertFalse(back.has_prev)
+
+    def test_null_timestamp(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        posts = [Post(body='post %d' % i, author=u) for i in range(3)]
+        db.session.add_all([u] + posts)
+        db.session.commit()
+        Post.query.filter_by(id=posts[0].id).update({'timestamp': None})
+        db.session.commit()
+        # 时间为NULL的行不参与游标分页, 不会在生成游标时出错
+        page = paginate_keyset(Post.query, (Post.timestamp, Post.id), 1)
+        self.assertIsNotNone(page.next_cursor)
+        page = paginate_keyset(Post.query, (Post.timestamp, Post.id), 1, after=page.next_cursor)
+        self.assertEqual(len(page.items), 1)
+        self.assertFalse(page.has_next)
+
+    def test_user_page_keyset(self):
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        db.session.add_all([u] + [Post(body='post %d' % i, author=u) for i in range(3)])
+        db.session.commit()
+        self.app.config['FLASKY_POST_PER_PAGE'] = 2
+        client = self.app.test_client()
+        response = client.get('/user/john?after=' + encode_cursor(datetime.datetime.utcnow(), 0))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('before=', response.get_data(as_text=True))
+        response = client.get('/user/john?page=2')
+        self.assertEqual(response.get_data(as_text=True).count('class="post"'), 1)
@@ -0,0 +1,54 @@
+import unittest
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+from .query_counter import QueryBudgetMixin
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, unittest.TestCase):
+    # 每个路由允许的最大查询数, 与页面上的文章和评论数量无关
+    BUDGETS = {
+        "/": 2,
+        "/user/user0": 2,
+        "/post/1": 3,
+        "/moderate": 1,   # 用户身份和角色来自缓存, 只剩评论的查询
+    }
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+        users = [User(email='user%d@example.com' % i, username='user%d' % i, password='cat', confirmed=True)
+                 for i in range(5)]
+        users[0].role = Role.query.filter_by(name='Moderator').first()
+        db.session.add_all(users)
+        db.session.commit()
+        posts = [Post(body='post *%d*' % i, author=users[i % 5]) for i in range(20)]
+        db.session.add_all(posts)
+        db.session.commit()
+        db.session.add_all([Comment(body='comment %d' % i, author=users[i % 5], post=posts[i % 2])
+                            for i in range(20)])
+        db.session.commit()
+        db.session.remove()   # 清空identity map, 避免请求命中测试中已加载的对象
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_anonymous_budgets(self):
+        for url in ("/", "/user/user0", "/post/1"):
+            with self.assertQueryBudget(self.BUDGETS[url], url):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_moderate_budget(self):
+        response = self.client.post('/auth/login', data={'email': 'user0@example.com', 'password': 'cat'})
+        self.assertEqual(response.status_code, 302)
+        self.client.get('/moderate')   # 第一次请求时缓存用户身份
+        db.session.remove()
+        with self.assertQueryBudget(self.BUDGETS["/moderate"], "/moderate"):
+            response = self.client.get('/moderate')
+        self.assertEqual(response.status_code, 200)
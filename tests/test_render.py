@@ -0,0 +1,108 @@
+import unittest
+from flask import render_template
+from app import create_app, db
+from app.models import User, Post, Comment
+from app.render import render_pool, render_cache, rerender_rows
+from app.fragments import fragment_cache
+
+
+class RenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_sync_render(self):
+        p = Post(body='*hello* <script>alert(1)</script>')
+        self.assertEqual(p.body_html, '<p><em>hello</em> alert(1)</p>')
+        c = Comment(body='# title')
+        self.assertEqual(c.body_html, 'title')
+
+    def test_render_cache(self):
+        render_cache.clear()
+        hits, misses = render_cache.hits, render_cache.misses
+        Post(body='same *body*')
+        Post(body='same *body*')
+        Comment(body='same *body*')   # 标签白名单不同, 不共用缓存
+        self.assertEqual(render_cache.hits - hits, 1)
+        self.assertEqual(render_cache.misses - misses, 2)
+        self.assertEqual(len(render_cache), 2)
+
+    def test_async_render(self):
+        self.app.config['FLASKY_ASYNC_RENDER'] = True
+        u = User(email='john@example.com', username='john', password='cat')
+        render_cache.clear()
+        p = Post(body='*hello*', author=u)
+        self.assertIsNone(p.body_html)
+        db.session.add(p)
+        db.session.commit()
+        self.assertTrue(render_pool.join(timeout=30))
+        self.assertEqual(p.body_html, '<p><em>hello</em></p>')
+        # 回滚的修改不会被渲染写回
+        p.body = '**changed**'
+        db.session.flush()
+        db.session.rollback()
+        self.assertTrue(render_pool.join(timeout=30))
+        self.assertEqual(p.body_html, '<p><em>hello</em></p>')
+
+    def test_render_reservation(self):
+        self.app.config['FLASKY_ASYNC_RENDER'] = True
+        self.app.config['FLASKY_RENDER_MAX_PENDING'] = 1
+        u = User(email='john@example.com', username='john', password='cat')
+        render_cache.clear()
+        posts = [Post(body='*post %d*' % i, author=u) for i in range(2)]
+        db.session.add_all(posts)
+        db.session.flush()
+        # flush时预留名额, 超过上限的在flush中同步渲染
+        self.assertEqual(render_pool.pending, 1)
+        self.assertEqual([p.body_html is None for p in posts], [True, False])
+        db.session.rollback()
+        self.assertEqual(render_pool.pending, 0)
+        # 请求结束时直接关闭会话也要归还名额
+        for i in range(3):
+            db.session.add(Post(body='*again %d*' % i, author=u))
+            db.session.flush()
+            db.session.remove()
+        self.assertEqual(render_pool.pending, 0)
+
+    def test_rerender_rows(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        posts = [Post(body='*post %d*' % i, author=u) for i in range(5)]
+        db.session.add_all([u] + posts)
+        db.session.commit()
+        Post.query.filter(Post.id > 2).update({'body_html': 'stale'}, synchronize_session=False)
+        db.session.commit()
+        progress = list(rerender_rows(Post, 'post', chunk_size=2, max_workers=1))
+        self.assertEqual(progress, [(2, 0, 2), (2, 2, 4), (1, 1, 5)])
+        self.assertEqual(Post.query.get(5).body_html, '<p><em>post 4</em></p>')
+        # 从中断处继续
+        self.assertEqual(list(rerender_rows(Post, 'post', chunk_size=2, start_id=4, max_workers=1)), [(1, 0, 5)])
+
+    def test_fragment_cache(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        p = Post(body='*hello*', author=u)
+        db.session.add(p)
+        db.session.commit()
+        with self.app.test_request_context():
+            hits = fragment_cache.hits
+            html = render_template('_post.html', posts=[p])
+            self.assertIn('<em>hello</em>', html)
+            self.assertEqual(len(fragment_cache), 1)
+            self.assertEqual(render_template('_post.html', posts=[p]), html)
+            self.assertEqual(fragment_cache.hits - hits, 1)
+            # 修改后版本号改变, 不会再命中旧的片段
+            p.body = '*bye*'
+            db.session.commit()
+            self.assertIn('<em>bye</em>', render_template('_post.html', posts=[p]))
+            # 作者改名后片段中的作者链接随之改变
+            u.username = 'johnny'
+            db.session.commit()
+            self.assertIn('/user/johnny', render_template('_post.html', posts=[p]))
+            # 编辑按钮在片段之外, 按当前用户生成
+            self.assertNotIn('Edit', html)
@@ -1,6 +1,13 @@
 import unittest
+import datetime
+import os
+import tempfile
+import time
+import sqlalchemy
 from app import create_app, db
-from app.models import User, Permission, AnonymousUser
+from app.last_seen import LastSeenBuffer
+from app.models import User, Permission, AnonymousUser, Post, Comment, Timeline, reconcile_counters, \
+    last_seen_buffer, load_cached_user, identity_cache, Role
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -49,3 +56,151 @@ class UserModelTestCase(unittest.TestCase):
         self.assertFalse(u.can(Permission.WRITE))
         self.assertFalse(u.can(Permission.MODERATE))
         self.assertFalse(u.can(Permission.ADMIN))
+
+    def test_followed_posts_timeline(self):
+        u1 = User(email='john@example.com', username='john', password='cat')
+        u2 = User(email='susan@example.org', username='susan', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        p1 = Post(body='post from susan', author=u2)
+        db.session.add(p1)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.all(), [])
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.all(), [p1])
+        p2 = Post(body='post from john', author=u1)
+        db.session.add(p2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.all(), [p2, p1])
+        self.assertEqual(u2.followed_posts.all(), [p1])
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.all(), [p2])
+        Timeline.query.delete()
+        db.session.commit()
+        Timeline.rebuild()
+        self.assertEqual(u1.followed_posts.all(), [p2])
+        self.assertEqual(u2.followed_posts.all(), [p1])
+
+    def test_counters(self):
+        u1 = User(email='john@example.com', username='john', password='cat')
+        u2 = User(email='susan@example.org', username='susan', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual((u1.followers_count, u1.followed_count), (1, 1))
+        u1.follow(u2)
+        p = Post(body='post from susan', author=u2)
+        db.session.add(p)
+        db.session.commit()
+        self.assertEqual((u1.followers_count, u1.followed_count), (1, 2))
+        self.assertEqual((u2.followers_count, u2.post_count), (2, 1))
+        c = Comment(body='nice', post=p, author=u1)
+        db.session.add(c)
+        db.session.commit()
+        self.assertEqual(p.comment_count, 1)
+        db.session.delete(c)
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual((p.comment_count, u2.followers_count), (0, 1))
+        # 计数出现偏差后可以批量修复
+        p.comment_count = 5
+        db.session.commit()
+        repaired = reconcile_counters()
+        self.assertEqual(repaired['posts.comment_count'], 1)
+        self.assertEqual(repaired['users.post_count'], 0)
+        self.assertEqual(p.comment_count, 0)
+
+    def test_gravatar(self):
+        u = User(email='john@example.com', password='cat')
+        with self.app.test_request_context('/'):
+            gravatar = u.gravatar()
+            gravatar_256 = u.gravatar(size=256)
+        self.assertTrue('https://secure.gravatar.com/avatar/' +
+                        'd4c74594d841139328695756648b6bd6' in gravatar)
+        self.assertTrue('s=256' in gravatar_256)
+        # 使用缓存的hash, 不再重新计算
+        u.avatar_hash = '0' * 32
+        self.assertTrue('/avatar/' + '0' * 32 in u.gravatar())
+
+    def test_backfill_avatar_hashes(self):
+        u = User(email='John@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        u.avatar_hash = None
+        db.session.commit()
+        self.assertEqual(User.backfill_avatar_hashes(), 1)
+        self.assertEqual(u.avatar_hash, 'd4c74594d841139328695756648b6bd6')
+        self.assertEqual(User.backfill_avatar_hashes(), 0)
+
+    def test_last_seen_buffer(self):
+        u1 = User(email='john@example.com', username='john', password='cat')
+        u2 = User(email='susan@example.org', username='susan', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        last_seen_buffer.flush()
+        now = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        last_seen_buffer.touch(u1.id, now, db.engine, flush_size=2)
+        # 粒度之内的访问被忽略, 达到数量之前不写入
+        last_seen_buffer.touch(u1.id, now + datetime.timedelta(seconds=1), db.engine, flush_size=2)
+        self.assertEqual(len(last_seen_buffer), 1)
+        self.assertTrue(u1.last_seen < now)
+        last_seen_buffer.touch(u2.id, now, db.engine, flush_size=2)
+        self.assertEqual(len(last_seen_buffer), 0)
+        db.session.expire_all()
+        self.assertEqual((u1.last_seen, u2.last_seen), (now, now))
+
+    def test_last_seen_timed_flush(self):
+        # 后台线程使用自己的连接, 内存数据库不能共享, 用临时文件中的数据库
+        path = os.path.join(tempfile.mkdtemp(), 'last_seen.sqlite')
+        engine = sqlalchemy.create_engine('sqlite:///' + path)
+        User.__table__.create(engine)
+        engine.execute(User.__table__.insert().values(id=1, username='john'))
+        buffer = LastSeenBuffer(User.__table__)
+        now = datetime.datetime(2030, 1, 1)
+        buffer.touch(1, now, engine, flush_interval=0.1, flush_size=100)
+        self.assertEqual(len(buffer), 1)
+        # 没有新的访问, 由后台线程按时间写入
+        last_seen = db.select([User.__table__.c.last_seen])
+        deadline = time.monotonic() + 5
+        while engine.execute(last_seen).scalar() != now and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(engine.execute(last_seen).scalar(), now)
+        self.assertEqual(len(buffer), 0)
+
+    def test_identity_cache(self):
+        Role.insert_roles()
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(load_cached_user(u.id), u)
+        self.assertEqual(identity_cache.get(u.id).username, 'john')
+        db.session.remove()
+        u = load_cached_user(u.id)
+        self.assertTrue(u.can(Permission.WRITE))
+        self.assertFalse(u.can(Permission.MODERATE))
+        # 提交对用户的修改后缓存失效
+        u.username = 'johnny'
+        db.session.commit()
+        self.assertIsNone(identity_cache.get(u.id))
+        self.assertEqual(load_cached_user(u.id).username, 'johnny')
+        # 修改角色后全部失效
+        u.role.add_permissions(Permission.MODERATE)
+        db.session.commit()
+        self.assertEqual(len(identity_cache), 0)
+
+    def test_password_rehash(self):
+        self.app.config['FLASKY_PASSWORD_HASH_ITERATIONS'] = 500
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:500$'))
+        self.app.config['FLASKY_PASSWORD_HASH_ITERATIONS'] = 1000
+        # 验证失败时不改变hash
+        self.assertFalse(u.verify_password('dog'))
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:500$'))
+        self.assertTrue(u.verify_password('cat'))
+        db.session.remove()
+        u = User.query.filter_by(email='john@example.com').first()
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(u.verify_password('cat'))